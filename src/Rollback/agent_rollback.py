@@ -1,7 +1,7 @@
 import time
-import math
 from threading import Thread
 import vehicle
+from geometry import bearing, distance, heading_difference
 import pygame
 
 
@@ -87,47 +87,12 @@ class Agent():
 		cangle = self.vehicle.orientation
 		if (cangle is None):
 			cangle = 0
-		diff = int(math.fabs(angle - cangle))
-		if (diff > 180):
-			diff = 360 - diff
-			if (cangle < angle):
-				da = -diff
-			else:
-				da = diff
-		else:
-			if (cangle < angle):
-				da = diff
-			else:
-				da = -diff
+		da = int(heading_difference(angle, cangle))
 		self.vehicle.set_angle(da // 3)
 
 	def get_vector_between_points(self, x1, y1, x2, y2):
 		if (x1 != None and y1 != None):
-			dx = x2 - x1
-			dy = y2 - y1
-			dist = int(math.sqrt(dx * dx + dy * dy))
-			theta = 0
-			if (dx != 0):
-				theta = math.atan(dy / dx) * (180 / math.pi)
-			if (dx == 0):
-				if (dy <= 0):
-					theta = 0
-				else:
-					theta = 180
-			elif (dy == 0):
-				if (dx < 0):
-					theta = 270
-				else:
-					theta = 90
-			elif (dx > 0 and dy > 0):
-				theta = theta + 90
-			elif (dx > 0 and dy < 0):
-				theta = theta + 90
-			elif (dx < 0 and dy > 0):
-				theta = theta + 270
-			elif (dx < 0 and dy < 0):
-				theta = theta + 270
-			return (dist, theta)
+			return (int(distance((x1, y1), (x2, y2))), bearing((x1, y1), (x2, y2)))
 		return (None, None)
 
 	# Return Distance and Angle to current waypoint. Angle must be degrees clockwise from north
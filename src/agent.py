@@ -1,15 +1,90 @@
 import time
-import math
-from threading import Thread
+from threading import Thread, Event, Lock
 import vehicle
+from geometry import bearing, distance, heading_difference
 import pygame
+from world import pin_snapshot
+from strategy_process import StrategyProcess
+from strategy_registry import registry, StrategyError
+from profiling import DecisionProfile, watchdog
+from timer_wheel import timers
+from constants import *
 
 
 msgHeader = "[AGENT]: "
 
+# Gamepad layout for manual cars.
+STICK_AXIS = 0
+LEFT_TRIGGER_AXIS = 2
+RIGHT_TRIGGER_AXIS = 5
+B_BUTTON = 1
+X_BUTTON = 2
+Y_BUTTON = 3
+LEFT_BUMPER = 4
+RIGHT_BUMPER = 5
 
-class Agent():
-	def __init__(self, ID, agentType="robot", vehicleType="car", strategyFile=None):
+
+# Decision scheduling shared by agents and fleets. The owner is woken whenever a new snapshot arrives, and
+# decides no more often than min_interval, and at least every idle_interval. Decisions are timed, and one
+# that runs past the deadline has its cars stopped.
+class DecisionLoop():
+	def init_scheduling(self, max_decision_rate, idle_interval, deadline):
+		self.wake = Event()  # Set whenever a new snapshot arrives.
+		self.min_interval = 1.0 / max_decision_rate  # Minimum time between decisions.
+		self.idle_interval = idle_interval  # Decide at least this often, even without new snapshots.
+		self.profile = DecisionProfile(deadline)
+		self.stopped = False
+		self.tracking_healthy = True
+
+	def update(self):
+		watchdog.watch(self.profile, self.overrun)
+		try:
+			self.run_decisions()
+		finally:
+			watchdog.unwatch(self.profile)
+
+	def run_decisions(self):
+		halted = False
+		last_decision = 0
+		while True:
+			self.wake.wait(self.idle_interval)
+			if self.stopped or not self.strategy:
+				return
+			# Snapshots that arrive within the minimum interval are coalesced into the next decision.
+			remaining = last_decision + self.min_interval - time.monotonic()
+			if remaining > 0:
+				time.sleep(remaining)
+				if self.stopped:
+					return
+			self.wake.clear()
+			last_decision = time.monotonic()
+			if not self.tracking_healthy: # Positions are stale, so hold the cars until tracking recovers.
+				if not halted:
+					self.halt()
+					halted = True
+			else:
+				halted = False
+				self.profile.begin()
+				try:
+					self.decide()
+				finally:
+					self.profile.end()
+					if self.profile.flagged:  # Checked after end(), as the watchdog can't flag it from then on.
+						for vehicle in self.vehicles():
+							vehicle.release_drive()
+
+	# Called from the watchdog thread while a decision is still running past its deadline. The cars stay
+	# stopped until that decision returns, however many drive commands it still sends.
+	def overrun(self):
+		print(msgHeader + "Decision for " + self.name() + " overran its " + str(self.profile.deadline) + " s deadline. Stopping.")
+		for vehicle in self.vehicles():
+			vehicle.hold_drive()
+
+
+class Agent(DecisionLoop):
+	def __init__(self, ID, agentType="robot", vehicleType="car", strategyFile=None,
+				 max_decision_rate=AGENT_MAX_DECISION_RATE, idle_interval=AGENT_IDLE_INTERVAL,
+				 deadline=DECISION_DEADLINE, process=None):
 		self.ID = str(ID)
 
 		if vehicleType.lower() == "car":
@@ -25,26 +100,47 @@ class Agent():
 			self.vehicle = vehicle.Car(self)
 
 		self.worldKnowledge = {}
+		self.latest_world = None  # Newest snapshot, swapped in by the main thread.
+		self.world = None  # Snapshot pinned for the decision in progress.
+		self.known_keys = 0
+		self.init_scheduling(max_decision_rate, idle_interval, deadline)
+		self.fleet = None  # Set when the strategy decides for every agent using it at once. See fleet.py.
 
+		self.strategyFile = strategyFile
 		self.strategy = None
+		self.load_error = None  # Why the strategy file couldn't be loaded, for main to report.
 		if strategyFile is not None and strategyFile != "Manual": # Do not look for 'manual' strategy file
 			try:
-				self.strategy = import_file("strategy", strategyFile)
+				self.strategy = registry.load(strategyFile)
 				print(msgHeader + "Successfully loaded the strategy file for Agent " + self.ID + ".")
-			except:
-				print(msgHeader + "Could not load the strategy file for Agent " + self.ID + ". (Fatal)")
-				exit()
+			except StrategyError as e:
+				print(msgHeader + "Could not load the strategy file for Agent " + self.ID + ". " + str(e))
+				self.load_error = str(e)
 		elif strategyFile is not None and strategyFile == "Manual": # Mark agent as a manual car
 			self.strategy = "Manual"
 			print(msgHeader + "Manual agent successfully initialised.")
+		self.triggers = {LEFT_TRIGGER_AXIS: -1.0, RIGHT_TRIGGER_AXIS: -1.0} # Released triggers read -1
+		self.manual_pending = {} # Channel -> value waiting to be sent.
+		self.manual_sent = {} # Channel -> last value sent.
+		self.manual_sent_at = {} # Channel -> when it was sent.
+		self.manual_timers = {} # Channel -> timer that sends the pending value.
+		self.manual_lock = Lock() # Guards the manual_* dicts, shared by the display and timer threads.
 
-		self.stopped = False
+		# Strategies opt in to a worker process with RUN_IN_PROCESS = True, unless the process kwarg overrides it.
+		self.worker = None
+		if process is None:
+			process = getattr(self.strategy, "RUN_IN_PROCESS", False)
+		if process and self.strategy not in (None, "Manual"):
+			self.worker = StrategyProcess(self, strategyFile)
 
 	def start(self):
-		if self.strategy == "Manual":
-			t_process = Thread(target=self.manual_control)
-			t_process.daemon = True
-			t_process.start()
+		if self.strategy == "Manual": # Driven by gamepad events from the display, so there's no thread to start.
+			return self
+		elif self.worker is not None:
+			self.worker.start(self.latest_world)
+			return self
+		elif self.fleet is not None:
+			self.fleet.start()
 			return self
 		else:
 			t_process = Thread(target=self.update)
@@ -52,21 +148,68 @@ class Agent():
 			t_process.start()
 			return self
 
-	def update(self):
-		while True:
-			if self.stopped or not self.strategy:
-				return
-			self.strategy.make_decision(self)
-			time.sleep(0.2)
+	# Hot-swap the strategy module. Takes effect from the next decision.
+	def set_strategy(self, module):
+		self.strategy = module
+		if self.fleet is not None:
+			self.fleet.strategy = module
+
+	def name(self):
+		return "Agent " + self.ID
+
+	# Decision timings for this agent, which live on the fleet if the agent decides as part of one, and are
+	# reported by the worker if it decides in its own process.
+	def decision_profile(self):
+		if self.worker is not None:
+			return self.worker.decision_profile()
+		if self.fleet is not None:
+			return self.fleet.profile
+		return self.profile
+
+	def decide(self):
+		self.refresh_world_knowledge()
+		self.strategy.make_decision(self)
+
+	def halt(self):
+		self.vehicle.stop()
+
+	def vehicles(self):
+		return [self.vehicle]
 
 	def stop(self):
 		self.vehicle.stop()
 		self.stopped = True
+		self.wake.set()
+		if self.worker is not None:
+			self.worker.stop()
+		if self.fleet is not None:
+			self.fleet.stop()
+
+	# Called from the main thread. Only swaps a reference and wakes the agent thread to decide on it.
+	def update_world_knowledge(self, snapshot):
+		self.latest_world = snapshot
+		self.tracking_healthy = snapshot.tracking_healthy
+		self.wake.set()
+		if self.worker is not None:
+			self.worker.publish(snapshot)
+		if self.fleet is not None:
+			self.fleet.update_world_knowledge(snapshot)
 
-	def update_world_knowledge(self, worldData):
+	# Pin the newest snapshot, or the one given, for this thread and copy the keys the strategy asked for.
+	def refresh_world_knowledge(self, snapshot=None):
+		if snapshot is None:
+			snapshot = self.latest_world
+		if snapshot is None:
+			return
+		# Strategies subscribe to world keys lazily, so new keys are filled even if the snapshot is unchanged.
+		if snapshot is self.world and len(self.worldKnowledge) == self.known_keys:
+			return
+		self.world = snapshot
+		self.known_keys = len(self.worldKnowledge)
+		pin_snapshot(snapshot)
 		for key in self.worldKnowledge:
-			if key in worldData:
-				self.worldKnowledge[key] = worldData[key]
+			if key in snapshot:
+				self.worldKnowledge[key] = snapshot[key]
 
 	def aim_speed(self, speed):
 		cspeed = self.vehicle.current_speed
@@ -87,47 +230,12 @@ class Agent():
 		cangle = self.vehicle.orientation
 		if (cangle is None):
 			cangle = 0
-		diff = int(math.fabs(angle - cangle))
-		if (diff > 180):
-			diff = 360 - diff
-			if (cangle < angle):
-				da = -diff
-			else:
-				da = diff
-		else:
-			if (cangle < angle):
-				da = diff
-			else:
-				da = -diff
+		da = int(heading_difference(angle, cangle))
 		self.vehicle.set_angle(da // 3)
 
 	def get_vector_between_points(self, x1, y1, x2, y2):
 		if (x1 != None and y1 != None):
-			dx = x2 - x1
-			dy = y2 - y1
-			dist = int(math.sqrt(dx * dx + dy * dy))
-			theta = 0
-			if (dx != 0):
-				theta = math.atan(dy / dx) * (180 / math.pi)
-			if (dx == 0):
-				if (dy <= 0):
-					theta = 0
-				else:
-					theta = 180
-			elif (dy == 0):
-				if (dx < 0):
-					theta = 270
-				else:
-					theta = 90
-			elif (dx > 0 and dy > 0):
-				theta = theta + 90
-			elif (dx > 0 and dy < 0):
-				theta = theta + 90
-			elif (dx < 0 and dy > 0):
-				theta = theta + 270
-			elif (dx < 0 and dy < 0):
-				theta = theta + 270
-			return (dist, theta)
+			return (int(distance((x1, y1), (x2, y2))), bearing((x1, y1), (x2, y2)))
 		return (None, None)
 
 	# Return Distance and Angle to current waypoint. Angle must be degrees clockwise from north
@@ -143,6 +251,14 @@ class Agent():
 					return self.get_vector_between_points(x1, y1, x2, y2)
 		return (None, None)
 
+	# Return the index of the nearest waypoint and the distance travelled along the route, from the map's lookup grids
+	def get_route_position(self):
+		position = self.vehicle.position
+		if position is None or self.world is None:
+			return (None, None)
+		route = self.world['route']
+		return (route.nearest_waypoint(position[0], position[1]), route.progress(position[0], position[1]))
+
 	# Return current waypoint index
 	def get_waypoint_index(self):
 		return self.worldKnowledge['waypoint_index']
@@ -156,68 +272,65 @@ class Agent():
 			wp = mmax
 		self.worldKnowledge['waypoint_index'] = wp
 		
-	def manual_control(self):
-		joystick = pygame.joystick.Joystick(0)
-		prev_axes = (0, 0) # Use to check if axis input has been made
-		prev_buttons =  (0, 0, 0, 0, 0, 0, 0, 0)# Use to check if button has been pressed
-		while True:
-			if self.stopped:
-				return
-			else: 
-				# Get gamepad button and axis states
-				left_stick = joystick.get_axis(0)
-				left_trigger = joystick.get_axis(2)
-				right_trigger = joystick.get_axis(5)
-				left_bumper = joystick.get_button(4)
-				right_bumper = joystick.get_button(5)
-				A = joystick.get_button(0)
-				B = joystick.get_button(1)
-				X = joystick.get_button(2)
-				Y = joystick.get_button(3)
-				L3 = joystick.get_button(8)
-				R3 = joystick.get_button(9)
-				axes = (left_stick, left_trigger, right_trigger)
-				buttons = (left_bumper, right_bumper, A, B, X, Y, L3, R3)
-				
-				if axes != prev_axes:
-					self.vehicle.set_angle(int(64*left_stick)) # Left stick controls left/right steering)
-					# If both right trigger and left trigger are pressed simultaneously, right trigger takes precedence
-					if right_trigger >= -0.8:
-						self.vehicle.set_speed(int(63*((right_trigger+1)/2))) # Set forward speed according to right trigger press
-					elif left_trigger >= -0.8:	
-						self.vehicle.set_speed(int(-64*((left_trigger+1)/2))) # Set backward speed according to left trigger press
-					elif right_trigger < -0.8 and left_trigger < -0.8: # If neither trigger is being pressed, stop the car
-						self.vehicle.stop()
-					prev_axes = axes
-				if buttons != prev_buttons:
-					if X and not self.vehicle.horn_active:	# X activates horn
-						self.vehicle.horn_on()
-					if not X and self.vehicle.horn_active:	# Deactivate horn when X is released
-						self.vehicle.horn_off()
-					if left_bumper: # Left bumper toggles left indicator
-						if self.vehicle.left_signal_active:
-							self.vehicle.left_signal_off()
-						else:
-							self.vehicle.left_signal_on()
-					if right_bumper: # Right bumper toggles right indicator
-						if self.vehicle.right_signal_active:
-							self.vehicle.right_signal_off()
-						else:
-							self.vehicle.right_signal_on()
-					if Y: # Y toggles headlights
-						if self.vehicle.headlights_active:
-							self.vehicle.headlights_off()
-						else:
-							self.vehicle.headlights_on()
-					if B: # B toggles police siren
-						if self.vehicle.police_siren_active:
-							self.vehicle.police_siren_off()
-						else:
-							self.vehicle.police_siren_on()
-
-def import_file(full_name, path):
-	from importlib import util
-	spec = util.spec_from_file_location(full_name, path)
-	mod = util.module_from_spec(spec)
-	spec.loader.exec_module(mod)
-	return mod
+	# Called from the display's event pump with pygame joystick events, for manual agents.
+	def handle_gamepad_event(self, event):
+		if event.type == pygame.JOYAXISMOTION:
+			if event.axis == STICK_AXIS:
+				self.send_manual("steering", int(64*event.value)) # Left stick controls left/right steering
+			elif event.axis in self.triggers:
+				self.triggers[event.axis] = event.value
+				right_trigger = self.triggers[RIGHT_TRIGGER_AXIS]
+				left_trigger = self.triggers[LEFT_TRIGGER_AXIS]
+				# If both right trigger and left trigger are pressed simultaneously, right trigger takes precedence
+				if right_trigger >= -0.8:
+					self.send_manual("throttle", int(63*((right_trigger+1)/2))) # Set forward speed according to right trigger press
+				elif left_trigger >= -0.8:
+					self.send_manual("throttle", int(-64*((left_trigger+1)/2))) # Set backward speed according to left trigger press
+				else: # If neither trigger is being pressed, stop the car
+					self.send_manual("throttle", 0)
+		elif event.type == pygame.JOYBUTTONDOWN:
+			if event.button == X_BUTTON: # X activates horn
+				self.vehicle.horn_on()
+			elif event.button == LEFT_BUMPER: # Left bumper toggles left indicator
+				self.vehicle.toggle_channel("left_signal")
+			elif event.button == RIGHT_BUMPER: # Right bumper toggles right indicator
+				self.vehicle.toggle_channel("right_signal")
+			elif event.button == Y_BUTTON: # Y toggles headlights
+				self.vehicle.toggle_channel("headlights")
+			elif event.button == B_BUTTON: # B toggles police siren
+				self.vehicle.toggle_channel("police_siren")
+		elif event.type == pygame.JOYBUTTONUP:
+			if event.button == X_BUTTON: # Deactivate horn when X is released
+				self.vehicle.horn_off()
+
+	# Send a steering or throttle value, dropping repeats and sending at most one value per channel every
+	# MANUAL_COMMAND_INTERVAL. A value held back by the rate limit is sent when the interval is up.
+	def send_manual(self, channel, value):
+		if self.stopped:
+			return
+		with self.manual_lock:
+			self.manual_pending[channel] = value
+			if channel in self.manual_timers:
+				return # Already waiting out the interval; the newest value goes when it ends.
+			remaining = self.manual_sent_at.get(channel, 0) + MANUAL_COMMAND_INTERVAL - time.monotonic()
+			if remaining > 0:
+				self.manual_timers[channel] = timers.schedule(remaining, self.flush_manual, channel)
+			else:
+				self._flush_manual(channel)
+
+	def flush_manual(self, channel):
+		with self.manual_lock:
+			self._flush_manual(channel)
+
+	# Called with manual_lock held.
+	def _flush_manual(self, channel):
+		self.manual_timers.pop(channel, None)
+		value = self.manual_pending.pop(channel, None)
+		if value is None or value == self.manual_sent.get(channel) or self.stopped:
+			return
+		if channel == "steering":
+			self.vehicle.set_angle(value)
+		else:
+			self.vehicle.set_speed(value)
+		self.manual_sent[channel] = value
+		self.manual_sent_at[channel] = time.monotonic()
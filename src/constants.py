@@ -8,4 +8,18 @@ STRATEGIES_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "stra
 MEDIA_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "media")
 ZENWHEELS_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), "zenwheels")
 
-CALIBRATION_IMG_PATH = os.path.join(MEDIA_DIR, 'checkerboard.png')
\ No newline at end of file
+CALIBRATION_IMG_PATH = os.path.join(MEDIA_DIR, 'checkerboard.png')
+
+# Vision execution model. "process" runs capture and tracking in their own processes,
+# "thread" runs them on threads in the main process, which suits hosts with 2-4 cores.
+VISION_MODE = "process"
+# Agent decision scheduling. Agents decide as soon as a new world snapshot arrives, but no more
+# than AGENT_MAX_DECISION_RATE times a second, and at least every AGENT_IDLE_INTERVAL seconds.
+AGENT_MAX_DECISION_RATE = 30
+AGENT_IDLE_INTERVAL = 0.2
+
+# Seconds a single decision may take before the agent's car is stopped as a precaution.
+DECISION_DEADLINE = 0.1
+
+# Seconds between steering or throttle commands from a manual car's gamepad.
+MANUAL_COMMAND_INTERVAL = 0.03
@@ -0,0 +1,132 @@
+import numpy as np
+from geometry import bearing, heading_difference
+
+
+msgHeader = "[CONTROLLERS]: "
+
+MAX_RIGHT = 63  # Steering and throttle command limits, as accepted by Vehicle.set_angle and set_speed.
+MAX_LEFT = -64
+SPEED_WINDOW = 0.5  # Seconds of pose history used to estimate each car's speed.
+STANLEY_SOFTENING = 10.0  # World pixels per second added to the speed, so Stanley doesn't oversteer slow cars.
+
+# Defaults per Vehicle subclass. Distances are world pixels, angles degrees, speeds throttle commands.
+#  wheelbase: distance between the axles.
+#  max_steer: wheel angle at full lock, which maps to the steering command limits.
+#  lookahead, lookahead_gain: pure pursuit looks lookahead + lookahead_gain * (speed in pixels per second) ahead.
+#  stanley_gain: how hard Stanley corrects cross-track error.
+#  cruise, min_speed: throttle on straights, and the least it will slow to for corners.
+#  corner_slowdown: throttle is divided by 1 + corner_slowdown * (sharpest curvature ahead).
+DEFAULTS = {
+	"Car": {"wheelbase": 45, "max_steer": 30, "lookahead": 60, "lookahead_gain": 0.5, "stanley_gain": 1.5,
+			"cruise": 50, "min_speed": 8, "corner_slowdown": 100},
+	"Truck": {"wheelbase": 65, "max_steer": 25, "lookahead": 90, "lookahead_gain": 0.6, "stanley_gain": 1.0,
+			  "cruise": 40, "min_speed": 6, "corner_slowdown": 150},
+	"Motorcycle": {"wheelbase": 22, "max_steer": 35, "lookahead": 40, "lookahead_gain": 0.4, "stanley_gain": 2.0,
+				   "cruise": 60, "min_speed": 8, "corner_slowdown": 80},
+	"Bicycle": {"wheelbase": 18, "max_steer": 35, "lookahead": 35, "lookahead_gain": 0.4, "stanley_gain": 2.0,
+				"cruise": 20, "min_speed": 5, "corner_slowdown": 60},
+}
+
+
+# Follows a map's Route with one or more vehicles. step() works on every car at once; drive() reads the
+# cars from a world snapshot and sends them the commands. steer(controller, poses, speeds) gives the wheel
+# angles in radians, such as pure_pursuit or stanley below. Keyword arguments override DEFAULTS for all cars.
+class PathController():
+	def __init__(self, route, vehicles, steer, **overrides):
+		self.route = route
+		self.vehicles = list(vehicles)
+		self.steer = steer
+		for name in DEFAULTS["Car"]:
+			values = [overrides.get(name, DEFAULTS.get(type(vehicle).__name__, DEFAULTS["Car"])[name])
+					  for vehicle in self.vehicles]
+			setattr(self, name, np.array(values, dtype=np.float64))
+		self.max_steer = np.radians(self.max_steer)
+
+	# Commands for N cars from an N x 3 array of (x, y, heading) and their speeds in world pixels per second.
+	# Returns (steering commands, throttle commands) as integer arrays.
+	def step(self, poses, speeds):
+		poses = np.asarray(poses, dtype=np.float64).reshape(-1, 3)
+		speeds = np.nan_to_num(np.asarray(speeds, dtype=np.float64))
+		steer = self.steer(self, poses, speeds)
+		steering = np.clip(np.round(steer / self.max_steer * MAX_RIGHT), MAX_LEFT, MAX_RIGHT).astype(int)
+		return steering, self.throttle(poses, speeds)
+
+	# Slow down ahead of corners, looking as far ahead as the car covers in about a second.
+	def throttle(self, poses, speeds):
+		progress, _ = self.route.project(poses[:, 0:2])
+		curvature = self.route.max_curvature_ahead(progress, self.lookahead + speeds)
+		throttle = np.maximum(self.cruise / (1 + self.corner_slowdown * curvature), self.min_speed)
+		return np.clip(np.round(throttle), 0, MAX_RIGHT).astype(int)
+
+	# Steer and throttle every located car. Cars that can't be seen are stopped.
+	def drive(self, snapshot):
+		poses = np.full((len(self.vehicles), 3), np.nan)
+		speeds = np.zeros(len(self.vehicles))
+		for i, vehicle in enumerate(self.vehicles):
+			row = snapshot.index.get(vehicle.owner.ID)
+			if row is not None:
+				poses[i] = snapshot.poses[row]
+			history = snapshot.history(vehicle)
+			speed = history.speed(SPEED_WINDOW) if history is not None else None
+			if speed is not None:
+				speeds[i] = speed
+		located = ~np.isnan(poses).any(axis=1)
+		if len(self.route) < 2 or not located.any():
+			for vehicle in self.vehicles:
+				vehicle.stop()
+			return
+		steering = np.zeros(len(self.vehicles), dtype=int)
+		throttle = np.zeros(len(self.vehicles), dtype=int)
+		selected = self._select(located)
+		steering[located], throttle[located] = selected.step(poses[located], speeds[located])
+		for i, vehicle in enumerate(self.vehicles):
+			if located[i]:
+				vehicle.set_angle(int(steering[i]))
+				vehicle.set_speed(int(throttle[i]))
+			else:
+				vehicle.stop()
+
+	# A controller over a subset of the cars, sharing this one's route and per-car parameters.
+	def _select(self, mask):
+		if mask.all():
+			return self
+		subset = object.__new__(type(self))
+		subset.__dict__.update({name: value[mask] if isinstance(value, np.ndarray) else value
+								for name, value in self.__dict__.items()})
+		subset.vehicles = [vehicle for vehicle, keep in zip(self.vehicles, mask) if keep]
+		return subset
+
+
+# Pure pursuit: steer along the arc through a point on the route one lookahead distance ahead.
+def pure_pursuit(controller, poses, speeds):
+	lookahead = controller.lookahead + controller.lookahead_gain * speeds
+	progress, _ = controller.route.project(poses[:, 0:2])
+	targets = controller.route.point_at(progress + lookahead)
+	offsets = targets - poses[:, 0:2]
+	alpha = np.radians(heading_difference(bearing(poses[:, 0:2], targets), poses[:, 2]))
+	distance = np.maximum(np.hypot(offsets[:, 0], offsets[:, 1]), 1e-9)
+	return np.arctan2(2 * controller.wheelbase * np.sin(alpha), distance)
+
+
+# Stanley: correct the heading error to the route, plus the cross-track error at the front axle.
+def stanley(controller, poses, speeds):
+	route = controller.route
+	headings = np.radians(poses[:, 2])
+	front = poses[:, 0:2] + (controller.wheelbase / 2)[:, None] * np.stack((np.sin(headings), -np.cos(headings)), axis=1)
+	_, segments = route.project(front)
+	path_headings = np.radians(route.headings[segments])
+	heading_error = np.radians(heading_difference(route.headings[segments], poses[:, 2]))
+	# Offset from the route to the front axle, along the route's right-hand normal.
+	offsets = front - route.waypoints[segments]
+	lateral = offsets[:, 0] * np.cos(path_headings) + offsets[:, 1] * np.sin(path_headings)
+	return heading_error + np.arctan2(-controller.stanley_gain * lateral, speeds + STANLEY_SOFTENING)
+
+
+class PurePursuit(PathController):
+	def __init__(self, route, vehicles, **overrides):
+		PathController.__init__(self, route, vehicles, pure_pursuit, **overrides)
+
+
+class Stanley(PathController):
+	def __init__(self, route, vehicles, **overrides):
+		PathController.__init__(self, route, vehicles, stanley, **overrides)
@@ -5,6 +5,8 @@ import csv
 from os import listdir
 from os.path import isfile
 from constants import *
+from route import Route
+from map_compiler import compile_map, compile_cones
 import sys
 import datetime
 import time
@@ -19,6 +21,7 @@ class Display():
         pygame.init()
         self.screen = pygame.display.set_mode((DISPLAY_WIDTH, DISPLAY_HEIGHT))
         self.background_image = None
+        self.scaled_map = None # (source map, scaled map) cache
         self.default_text_position = (DISPLAY_WIDTH / 1.5, DISPLAY_HEIGHT / 1.2)
         self.font_general = pygame.font.SysFont('Arial', int(DISPLAY_WIDTH / 50)) # Font for general text
         self.font_timer = pygame.font.SysFont('Arial', int(DISPLAY_WIDTH / 30), True) # Font for timer text
@@ -113,12 +116,16 @@ class Display():
         self.screen.blit(text, self.default_text_position)
         pygame.display.flip()
 
+    # Scale a map to the display width. The map doesn't change during a scenario, so the result is cached.
+    def scale_map(self, raw_img):
+        if self.scaled_map is None or self.scaled_map[0] is not raw_img:
+            scale_factor = DISPLAY_WIDTH / raw_img.get_rect().size[0]
+            self.scaled_map = (raw_img, pygame.transform.rotozoom(raw_img, 0, scale_factor))
+        return self.scaled_map[1]
+
     # Create image from raw world data.
     def generate_image(self, world_data, laps):
-        raw_img = world_data["map"]
-        scale_factor = DISPLAY_WIDTH / raw_img.get_rect().size[0]
-        scaled_img = pygame.transform.rotozoom(raw_img, 0, scale_factor)
-        self.background_image = scaled_img
+        self.background_image = self.scale_map(world_data["map"])
         self.screen.blit(self.background_image, (0, 0))
         dt = datetime.datetime(2019, 1, 1) # Parameters don't matter, just used to get current date/time
         dt = dt.now().time() # Get current time
@@ -142,15 +149,20 @@ class Display():
             self.screen.blit(lap_text, (825, lap_y))
             lap_y += 25
             lap_count += 1
+
+        if not world_data.get('tracking_healthy', True):
+            warning_text = self.font_timer2.render("Tracking lost - restarting tracker...", True, (255, 0, 0))
+            self.screen.blit(warning_text, (DISPLAY_WIDTH / 3, 20))
             
         if self.DEBUG:
             yOffset = 0
             for vehicle in world_data['vehicles']:
                 try:
-                    if vehicle.position is None or vehicle.orientation is None:
+                    pos = world_data.position(vehicle.owner.ID)
+                    orientation = world_data.orientation(vehicle.owner.ID)
+                    if pos is None or orientation is None:
                         continue
-                    pos = vehicle.position
-                    angle = vehicle.orientation - 90
+                    angle = orientation - 90
                     pygame.draw.circle(self.screen, (0, 0, 0), pos, 50, 1)
                     angleLine = (
                     pos[0] + 200 * math.cos(math.radians(angle)), pos[1] + 200 * math.sin(math.radians(angle)))
@@ -170,6 +182,15 @@ class Display():
                     pygame.draw.circle(self.screen, (255,0,0), wp, 10, 1)
                 except Exception as e:
                     print(str(e))
+            # Decision timings, bottom left. Agents in a fleet share their fleet's timings.
+            if self.agents is not None:
+                yOffset = DISPLAY_HEIGHT - 25 * len(self.agents) - 10
+                for agent in self.agents:
+                    profile = agent.decision_profile()
+                    colour = (255, 0, 0) if profile.overruns else (0, 0, 0)
+                    text = self.font_timer2.render(agent.ID + ": " + profile.summary(), True, colour)
+                    self.screen.blit(text, (50, yOffset))
+                    yOffset += 25
 
     # Draw the cones and waypoints
     def draw_track(self, conePairs):
@@ -213,6 +234,11 @@ class Display():
                 if (event.mod & pygame.KMOD_SHIFT):
                     self.race_complete = True
                 else: self.lap = True
+            elif self.manual_mode and event.type in (JOYAXISMOTION, JOYBUTTONDOWN, JOYBUTTONUP):
+                if self.agents is not None: # Gamepad input drives the manual car
+                    for agent in self.agents:
+                        if agent.strategy == "Manual":
+                            agent.handle_gamepad_event(event)
         if self.gamepad:
             if self.joystick.get_button(8) and not self.debug_button_last:
                     self.DEBUG = not self.DEBUG
@@ -282,6 +308,7 @@ class Display():
                         path = os.path.join(MAPS_DIR, folder, file).replace("\\", "/")
                         map["Name"] = path.split("/")[-1].split(".")[0]
                         map["Image"] = pygame.image.load(path)
+                        map["Field"] = compile_map(path) # Wall clearance, cached next to the map image
                         width, height = map["Image"].get_rect().size
                         # Store blank image for use later
                         if map["Name"] == "map_blank":
@@ -299,7 +326,8 @@ class Display():
                                 y = int(int(y_str) * yScale)
                                 waypoints.append((x, y))
                         map["Waypoints"] = waypoints
-                if len(map) == 3:
+                        map["Route"] = Route(waypoints) # Precompute waypoint lookups once per map
+                if "Image" in map and "Waypoints" in map:
                     maps.append(map)
         if not maps:
             print(msgHeader + "Error: No maps in the map folder.")
@@ -528,9 +556,12 @@ class Display():
             pygame.quit()
             return False
             
-    def add_waypoints(self, waypoints, scenario_config):
+    def add_waypoints(self, waypoints, scenario_config, cones=None):
         print(msgHeader+"Adding user-defined waypoints to scenario_config.")
         scenario_config["Map"]["Waypoints"] = waypoints
+        scenario_config["Map"]["Route"] = Route(waypoints)
+        if cones is not None:
+            scenario_config["Map"]["Field"] = compile_cones(cones)
         return scenario_config
         
     def cone_recognition_screen(self, option = False):
@@ -545,10 +576,7 @@ class Display():
         pygame.display.flip()
         
     def countdown(self, world_data):
-        raw_img = world_data["map"]
-        scale_factor = DISPLAY_WIDTH / raw_img.get_rect().size[0]
-        scaled_img = pygame.transform.rotozoom(raw_img, 0, scale_factor)
-        self.background_image = scaled_img
+        self.background_image = self.scale_map(world_data["map"])
         self.screen.blit(self.background_image, (0, 0))
         countdown_text = self.font_countdown.render('3', True, (255, 0, 0))
         self.screen.blit(countdown_text, (DISPLAY_WIDTH/2.5, DISPLAY_HEIGHT/9))
@@ -0,0 +1,75 @@
+from threading import Thread
+from agent import DecisionLoop
+from world import pin_snapshot
+from constants import *
+
+
+msgHeader = "[FLEET]: "
+
+
+# The agents sharing a strategy that defines make_fleet_decisions(agents, snapshot). The strategy is called
+# once per tick for the whole fleet, so distance matrices, route progress and collision checks can be
+# computed once for every car instead of once per car.
+class Fleet(DecisionLoop):
+	def __init__(self, strategy, agents, max_decision_rate=AGENT_MAX_DECISION_RATE, idle_interval=AGENT_IDLE_INTERVAL,
+				 deadline=DECISION_DEADLINE):
+		self.strategy = strategy
+		self.agents = agents
+		self.latest_world = None
+		self.thread = None
+		self.init_scheduling(max_decision_rate, idle_interval, deadline)
+		for agent in agents:
+			agent.fleet = self
+
+	def start(self):
+		if self.thread is not None:  # Every member starts the fleet, but only the first one counts.
+			return
+		self.thread = Thread(target=self.update)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def stop(self):
+		self.stopped = True
+		self.wake.set()
+
+	def name(self):
+		return "the fleet of Agents " + ", ".join(agent.ID for agent in self.agents)
+
+	def update_world_knowledge(self, snapshot):
+		self.latest_world = snapshot
+		self.tracking_healthy = snapshot.tracking_healthy
+		self.wake.set()
+
+	def decide(self):
+		snapshot = self.latest_world
+		if snapshot is None:
+			return
+		for agent in self.agents:
+			agent.refresh_world_knowledge(snapshot)
+		pin_snapshot(snapshot)
+		if hasattr(self.strategy, "make_fleet_decisions"):
+			self.strategy.make_fleet_decisions(self.agents, snapshot)
+		else:  # Hot-swapped to a version without the fleet entry point.
+			for agent in self.agents:
+				agent.strategy.make_decision(agent)
+
+	def halt(self):
+		for agent in self.agents:
+			agent.vehicle.stop()
+
+	def vehicles(self):
+		return [agent.vehicle for agent in self.agents]
+
+
+# Group agents into fleets by strategy file. Agents whose strategy only decides for one car, or that run
+# in their own process, keep their own decision threads.
+def make_fleets(agents):
+	members = {}
+	for agent in agents:
+		if agent.worker is None and hasattr(agent.strategy, "make_fleet_decisions"):
+			members.setdefault(agent.strategyFile, []).append(agent)
+	fleets = []
+	for strategyFile, group in members.items():
+		fleets.append(Fleet(group[0].strategy, group))
+		print(msgHeader + "Agents " + ", ".join(agent.ID for agent in group) + " share a fleet strategy.")
+	return fleets
@@ -0,0 +1,60 @@
+import math
+from numbers import Real
+import numpy as np
+
+
+# Angles are degrees clockwise from north, with screen y growing downwards: a bearing of 90 points along +x.
+# Every function takes either single points and angles, which take a plain math fast path, or NumPy arrays
+# of them (points as N x 2), which are handled in one vectorised pass.
+
+
+# A single (x, y) point, rather than an array of them. Empty arrays take the vectorised path.
+def _is_point(point):
+	if isinstance(point, np.ndarray):
+		return point.shape == (2,)
+	return len(point) == 2 and isinstance(point[0], Real) and isinstance(point[1], Real)
+
+
+# Bearing from origin to target.
+def bearing(origin, target):
+	if _is_point(origin) and _is_point(target):
+		return math.degrees(math.atan2(target[0] - origin[0], origin[1] - target[1])) % 360
+	d = np.asarray(target, dtype=np.float64) - np.asarray(origin, dtype=np.float64)
+	return np.degrees(np.arctan2(d[..., 0], -d[..., 1])) % 360
+
+
+def distance(a, b):
+	if _is_point(a) and _is_point(b):
+		return math.hypot(b[0] - a[0], b[1] - a[1])
+	d = np.asarray(b, dtype=np.float64) - np.asarray(a, dtype=np.float64)
+	return np.hypot(d[..., 0], d[..., 1])
+
+
+# Wrap to [0, 360).
+def wrap(angle):
+	return angle % 360
+
+
+# Wrap to [-180, 180).
+def wrap_signed(angle):
+	return (angle + 180) % 360 - 180
+
+
+# Signed turn from current to target, in [-180, 180). Positive is clockwise, i.e. a right turn.
+def heading_difference(target, current):
+	if isinstance(target, Real) and isinstance(current, Real):
+		return (target - current + 180) % 360 - 180
+	return wrap_signed(np.subtract(target, current))
+
+
+# Unsigned angle between two headings, in [0, 180].
+def angle_between(a, b):
+	return abs(heading_difference(a, b))
+
+
+# Distances and bearings between every pair of N points, as two N x N arrays indexed [from, to].
+# The diagonal has zero distance and no meaningful bearing.
+def pairwise(points):
+	points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+	d = points[None, :, :] - points[:, None, :]
+	return np.hypot(d[..., 0], d[..., 1]), np.degrees(np.arctan2(d[..., 0], -d[..., 1])) % 360
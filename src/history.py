@@ -0,0 +1,89 @@
+import numpy as np
+
+
+HISTORY_LENGTH = 256  # Samples kept per vehicle, a little over 8 seconds at 30 fps.
+
+T, X, Y, HEADING = range(4)  # Sample columns.
+
+
+# Fixed-length ring buffer of timestamped poses for one vehicle.
+# Every sample is written twice, capacity slots apart, so the most recent samples are always one
+# contiguous slice of the buffer and can be read as a view without wrapping around. The main thread
+# appends while agent threads read, and once the buffer is full each append overwrites the oldest row
+# of any view still held, so the accessors below work on a copy.
+class PoseHistory():
+	def __init__(self, capacity=HISTORY_LENGTH):
+		self.capacity = capacity
+		self.buffer = np.full((2 * capacity, 4), np.nan)
+		self.head = 0  # Next slot to write, in [0, capacity).
+		self.count = 0
+
+	def append(self, t, x, y, heading=None):
+		sample = (t, x, y, np.nan if heading is None else heading)
+		self.buffer[self.head] = sample
+		self.buffer[self.head + self.capacity] = sample
+		self.head = (self.head + 1) % self.capacity
+		self.count = min(self.count + 1, self.capacity)
+
+	def clear(self):
+		self.count = 0
+
+	# Zero-copy view of every sample held, oldest first. Columns are (t, x, y, heading). Only stays in
+	# time order until the next append.
+	def view(self):
+		end = self.head + self.capacity
+		return self.buffer[end - self.count:end]
+
+	# Copy of the samples from the last `seconds` seconds, or everything held if seconds is None.
+	def window(self, seconds=None):
+		samples = self.view().copy()
+		if seconds is None or not len(samples):
+			return samples
+		start = np.searchsorted(samples[:, T], samples[-1, T] - seconds, side='left')
+		return samples[start:]
+
+	def latest(self):
+		if not self.count:
+			return None
+		return self.view()[-1].copy()
+
+	# Mean (vx, vy) in world pixels per second over the window.
+	def velocity(self, seconds=None):
+		samples = self.window(seconds)
+		if len(samples) < 2 or samples[-1, T] == samples[0, T]:
+			return None
+		return (samples[-1, X:HEADING] - samples[0, X:HEADING]) / (samples[-1, T] - samples[0, T])
+
+	def speed(self, seconds=None):
+		velocity = self.velocity(seconds)
+		if velocity is None:
+			return None
+		return float(np.hypot(*velocity))
+
+	# (ax, ay) in world pixels per second squared, from a least squares quadratic fit over the window.
+	def acceleration(self, seconds=None):
+		samples = self.window(seconds)
+		if len(samples) < 3:
+			return None
+		t = samples[:, T] - samples[0, T]
+		if t[-1] == 0:
+			return None
+		coefficients = np.polyfit(t, samples[:, X:HEADING], 2)
+		return 2 * coefficients[0]
+
+	# Mean change of heading in degrees per second over the window, positive clockwise.
+	def yaw_rate(self, seconds=None):
+		samples = self.window(seconds)
+		samples = samples[~np.isnan(samples[:, HEADING])]
+		if len(samples) < 2 or samples[-1, T] == samples[0, T]:
+			return None
+		headings = np.degrees(np.unwrap(np.radians(samples[:, HEADING])))
+		return float((headings[-1] - headings[0]) / (samples[-1, T] - samples[0, T]))
+
+	# Distance travelled along the sampled path, in world pixels.
+	def path_length(self, seconds=None):
+		samples = self.window(seconds)
+		if len(samples) < 2:
+			return 0.0
+		steps = np.diff(samples[:, X:HEADING], axis=0)
+		return float(np.sum(np.hypot(steps[:, 0], steps[:, 1])))
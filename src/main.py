@@ -3,6 +3,8 @@ from display import Display
 from vision import Vision
 from agent import Agent
 from world import World
+from fleet import make_fleets
+from strategy_registry import registry
 from zenwheels.comms import CarCommunicator
 import datetime
 from tracker.cone_detector import ConeDetector
@@ -26,9 +28,9 @@ if __name__ == "__main__":
 
 		# Run timing
 		if args[1] == "timing":
-            timing = True
-            timeNow = datetime.datetime.now()
-            filename = "logs/timing" + str(timeNow) + ".txt"
+			timing = True
+			timeNow = datetime.datetime.now()
+			filename = "logs/timing" + str(timeNow) + ".txt"
 		
 		if args[1] == "nogui":
 			assert(len(args) == 3), "Please add a single car number!"
@@ -85,7 +87,16 @@ if __name__ == "__main__":
 				display.error_message(errorMsg)
 				time.sleep(2)
 				continue # Go back to main menu after 2 seconds
+			broken = [agent for agent in agents if agent.load_error is not None]
+			if broken:
+				errorMsg = msgHeader + broken[0].load_error
+				print(errorMsg)
+				print(registry.errors.get(broken[0].strategyFile, ""), end="") # Full traceback, for fixing the file
+				display.error_message(errorMsg)
+				time.sleep(2)
+				continue # Go back to main menu so the strategy can be fixed
 			display.agents = agents # Pass agent list to display so that agents can be stopped if the program exits
+			make_fleets(agents) # Agents sharing a fleet strategy decide together, once per tick
 				
 			manual_cars = 0 # Check how many manual cars are enabled, show error if more than 1 has been enabled
 			for agent in agents:
@@ -105,6 +116,7 @@ if __name__ == "__main__":
 				if display.wait_for_confirmation():
 					display.cone_recognition_screen()
 					cones = vision.getCones()
+					coneLayout = list(cones)
 					newWaypoints = []
 					conePairs = []
 					# Track-Building Algorithm
@@ -118,7 +130,7 @@ if __name__ == "__main__":
 								minDist = currentDist
 								pairedIndex = cones.index(posPair)
 						conePairs.append((currentCone, cones[pairedIndex]))
-						newWaypoints.append((round((currentCone[0] + cones[pairedIndex][0])/2*1.6), round((currentCone[1] + cones[pairedIndex][1])/2*1.6)))
+						newWaypoints.append((round((currentCone[0] + cones[pairedIndex][0])/2), round((currentCone[1] + cones[pairedIndex][1])/2)))
 						cones.pop(pairedIndex)
 					newWaypoints.sort(key=lambda x: x[0])
 					new_newWaypoints = []  # 新list
@@ -140,13 +152,15 @@ if __name__ == "__main__":
 
 							new_newWaypoints.append(min_point)  # 找到与A最近的坐标B，放进新list
 							newWaypoints.remove(min_point)  # 从Newwaypoints里删除坐标B
-					display.add_waypoints(new_newWaypoints, scenario_config) # Add new waypoints to scenario_config
-					world = World(agents, vehicles, scenario_config["Map"]["Image"], scenario_config["Map"]["Waypoints"]) # Update world
+					display.add_waypoints(new_newWaypoints, scenario_config, coneLayout) # Add new waypoints to scenario_config
+					world = World(agents, vehicles, scenario_config["Map"]["Image"], scenario_config["Map"]["Waypoints"],
+								  scenario_config["Map"].get("Route"), scenario_config["Map"].get("Field")) # Update world
 				else:
 					continue
 				
 			else:
-				world = World(agents, vehicles, scenario_config["Map"]["Image"], scenario_config["Map"]["Waypoints"])
+				world = World(agents, vehicles, scenario_config["Map"]["Image"], scenario_config["Map"]["Waypoints"],
+							  scenario_config["Map"].get("Route"), scenario_config["Map"].get("Field"))
 
 			# Connect to selected cars.
 			display.connecting_screen()
@@ -158,9 +172,9 @@ if __name__ == "__main__":
 				time.sleep(2)
 				continue # Go back to main menu after 2 seconds
 			
-			# Identify car locations.
+			# Identify car locations. The cars are connected, so they can be told apart by flashing their lights.
 			display.identifying_screen(agents)
-			success = vision.identify(agents)
+			success = vision.identify(agents, by_lights=True)
 			if not success:
 				errorMsg = msgHeader + "Could not locate all of the specified cars."
 				print(errorMsg)
@@ -179,6 +193,7 @@ if __name__ == "__main__":
 			# Start agents.
 			print(msgHeader + "Starting agents.")
 			for agent in agents:
+				agent.update_world_knowledge(world.get_world_data())
 				agent.start()
 			dt = datetime.datetime(2019, 1, 1)
 			dt_time = dt.now().time() # Get current time
@@ -191,13 +206,19 @@ if __name__ == "__main__":
 			updates = 0
 			# Total 100 frames time
 			start = datetime.datetime.now()
+			generation = vision.generation()
 			while True:
 				s = ''
 
 				# Time get car locations
 				startTimeCarLocations = datetime.datetime.now()
-				car_locations = vision.get_car_locations()
-				world.update(car_locations)
+				# Only process new tracking data. The timeout keeps the display and input responsive if tracking stalls.
+				new_data = vision.wait_for_update(generation, timeout=0.1) is not None
+				changes = set()
+				if new_data:
+					generation, car_locations = vision.read_car_locations()
+					changes = world.update(car_locations)
+				health_changed = world.set_tracking_healthy(vision.tracking_healthy)
 				now = datetime.datetime.now()
 				s += "\nCar locations time : "
 				s += str((now - startTimeCarLocations).total_seconds())
@@ -233,15 +254,23 @@ if __name__ == "__main__":
 
 				# Time update agents
 				startTimeAgent = datetime.datetime.now()
-				for agent in agents:
-					agent.update_world_knowledge(world.get_world_data())
+				# Hot-swap strategy files edited since the last check. Agents pick them up at their next decision.
+				for strategyFile, module in registry.poll().items():
+					for agent in agents:
+						if agent.strategyFile == strategyFile:
+							agent.set_strategy(module)
+				if changes or health_changed:
+					for agent in agents:
+						agent.update_world_knowledge(world.get_world_data())
 				now = datetime.datetime.now()
 				s += "\nAgent time : "
 				s += str((now - startTimeAgent).total_seconds())
 
 				# Do timing
-                updates += 1
+				updates += 1
 				if timing:
+					for agent in agents:
+						s += "\nDecisions " + agent.ID + " : " + agent.decision_profile().summary()
 					print (s)
 					endTime = datetime.datetime.now()
 					timingFile = open(filename, "a+")
@@ -249,16 +278,16 @@ if __name__ == "__main__":
 					timingFile.write(s)
 					s= ""
 					if updates == 100:
-                        now = datetime.datetime.now()
-                        s += "\nTiming Finish: 100 Laps : "
-                        totalTime = (now - start).total_seconds()
-                        s += str(totalTime)
-                        averageTime = totalTime / 100
-                        s += "\nAverage Frame Time: "
-                        s += str(averageTime)
-                        timingFile.write(s)
-                        timing = False							
-				
+						now = datetime.datetime.now()
+						s += "\nTiming Finish: 100 Laps : "
+						totalTime = (now - start).total_seconds()
+						s += str(totalTime)
+						averageTime = totalTime / 100
+						s += "\nAverage Frame Time: "
+						s += str(averageTime)
+						timingFile.write(s)
+						timing = False
+
 			print(msgHeader + "Exited main loop.")
 
 			# Stop agents.
@@ -0,0 +1,128 @@
+import os
+import cv2
+import numpy as np
+from constants import *
+
+msgHeader = "[MAP COMPILER]: "
+
+FIELD_CELL = 4  # Display pixels per distance field cell.
+ROAD_THRESHOLD = 80  # Grey level below which a map pixel is drivable road.
+ROAD_MIN_WIDTH = 20  # Display pixels. Dark lines thinner than this, such as outlines, aren't road.
+ROAD_MIN_AREA = 2500  # Square display pixels. Dark patches smaller than this aren't road either.
+CONE_RADIUS = 20  # Radius in display pixels blocked out around each cone.
+FIELD_VERSION = 2  # Bump to invalidate cached fields when the compiler changes.
+
+
+# Occupancy grid of a map and its signed distance field, sampled every FIELD_CELL display pixels.
+class DistanceField():
+	def __init__(self, occupancy, sdf):
+		self.occupancy = occupancy  # True where the cell is drivable.
+		self.sdf = sdf  # Display pixels to the nearest wall, positive inside the drivable area.
+		gy, gx = np.gradient(sdf, FIELD_CELL)
+		self.gradient_x = gx
+		self.gradient_y = gy
+		self.rows, self.cols = sdf.shape
+		# Clearance at the middle of a typical road, i.e. its half width. A high percentile rather than the
+		# maximum, so one wide patch doesn't set it.
+		drivable = sdf[occupancy]
+		self.road_clearance = float(np.percentile(drivable, 95)) if drivable.size else 0.0
+
+	def _cell(self, x, y):
+		col = min(max(int(x // FIELD_CELL), 0), self.cols - 1)
+		row = min(max(int(y // FIELD_CELL), 0), self.rows - 1)
+		return row, col
+
+	# Signed distance to the nearest wall. Negative when (x, y) is outside the drivable area.
+	def clearance(self, x, y):
+		return float(self.sdf[self._cell(x, y)])
+
+	# Direction of increasing clearance, i.e. away from the nearest wall.
+	def gradient(self, x, y):
+		cell = self._cell(x, y)
+		return (float(self.gradient_x[cell]), float(self.gradient_y[cell]))
+
+	def is_drivable(self, x, y):
+		return bool(self.occupancy[self._cell(x, y)])
+
+
+# Compile a map image, reusing the cached field stored next to it if it is still current.
+def compile_map(image_path):
+	cache_path = os.path.splitext(image_path)[0] + ".field.npz"
+	if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(image_path):
+		try:
+			cached = np.load(cache_path)
+			if int(cached["version"]) == FIELD_VERSION and cached["sdf"].shape == _field_shape():
+				return DistanceField(cached["occupancy"], cached["sdf"])
+		except (OSError, KeyError, ValueError) as e:
+			print(msgHeader + "Ignoring unreadable cache " + cache_path + " (" + str(e) + ").")
+
+	image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+	if image is None:
+		print(msgHeader + "Could not read " + image_path + ".")
+		return None
+	occupancy = _occupancy_from_image(image)
+	field = DistanceField(occupancy, _signed_distance(occupancy))
+	_save(cache_path, field)
+	return field
+
+
+# Compile a cone layout, in world coordinates. Layouts change from run to run, so these aren't cached.
+def compile_cones(cones):
+	rows, cols = _field_shape()
+	blocked = np.zeros((rows, cols), np.uint8)
+	for x, y in cones:
+		cv2.circle(blocked, (int(x // FIELD_CELL), int(y // FIELD_CELL)), int(CONE_RADIUS // FIELD_CELL), 1, -1)
+	occupancy = _with_border(blocked == 0)
+	return DistanceField(occupancy, _signed_distance(occupancy))
+
+
+def _field_shape():
+	return (int(np.ceil(DISPLAY_HEIGHT / FIELD_CELL)), int(np.ceil(DISPLAY_WIDTH / FIELD_CELL)))
+
+
+# Maps are drawn scaled to the display width, so the field uses the same scale and is cropped or
+# padded to the display height.
+def _occupancy_from_image(image):
+	rows, cols = _field_shape()
+	height = max(1, int(round(image.shape[0] * cols / image.shape[1])))
+	scaled = cv2.resize(image, (cols, height), interpolation=cv2.INTER_AREA)
+	road = np.zeros((rows, cols), bool)
+	road[:min(rows, height)] = scaled[:rows] < ROAD_THRESHOLD
+	road = _remove_clutter(road)
+	if not road.any():  # No road drawn (e.g. the blank map), so the whole table is drivable.
+		road[:] = True
+	return _with_border(road)
+
+
+# Thin dark outlines (trees, buildings, the map border) pass the threshold too, and would become drivable
+# islands. An opening removes anything narrower than ROAD_MIN_WIDTH, then small leftover patches are dropped.
+def _remove_clutter(road):
+	size = int(round(ROAD_MIN_WIDTH / FIELD_CELL))
+	kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (size, size))
+	opened = cv2.morphologyEx(road.astype(np.uint8), cv2.MORPH_OPEN, kernel)
+	_, labels, stats, _ = cv2.connectedComponentsWithStats(opened)
+	keep = stats[:, cv2.CC_STAT_AREA] * FIELD_CELL ** 2 >= ROAD_MIN_AREA
+	keep[0] = False  # Label 0 is everything that isn't road.
+	return keep[labels]
+
+
+# The edge of the display is always a wall.
+def _with_border(occupancy):
+	occupancy = occupancy.copy()
+	occupancy[0, :] = occupancy[-1, :] = False
+	occupancy[:, 0] = occupancy[:, -1] = False
+	return occupancy
+
+
+def _signed_distance(occupancy):
+	drivable = occupancy.astype(np.uint8)
+	inside = cv2.distanceTransform(drivable, cv2.DIST_L2, 5)
+	outside = cv2.distanceTransform(1 - drivable, cv2.DIST_L2, 5)
+	return ((inside - outside) * FIELD_CELL).astype(np.float32)
+
+
+def _save(cache_path, field):
+	try:
+		np.savez_compressed(cache_path, version=FIELD_VERSION, occupancy=field.occupancy, sdf=field.sdf)
+	except OSError as e:
+		print(msgHeader + "Could not cache " + cache_path + " (" + str(e) + ").")
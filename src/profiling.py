@@ -0,0 +1,127 @@
+import os
+import time
+import threading
+import numpy as np
+
+
+msgHeader = "[PROFILING]: "
+
+# Upper edges of the decision duration histogram buckets, in seconds. The last bucket catches the rest.
+BUCKETS = np.array([0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, np.inf])
+
+WATCHDOG_INTERVAL = 0.01  # Seconds between deadline checks.
+
+COUNTERS = 5 + len(BUCKETS)  # Length of DecisionProfile.counters().
+
+
+# Decision timing for one agent or fleet: a duration histogram, jitter between decision intervals and
+# deadline overruns.
+class DecisionProfile():
+	def __init__(self, deadline):
+		self.deadline = deadline
+		self.histogram = np.zeros(len(BUCKETS), dtype=np.int64)
+		self.decisions = 0
+		self.total = 0.0
+		self.worst = 0.0
+		self.overruns = 0
+		self.jitter = 0.0  # Smoothed change between successive decision intervals, as in RFC 3550.
+		self.started = None  # Start of the decision in progress.
+		self.flagged = False  # The decision in progress has already been counted as an overrun.
+		self.last_start = None
+		self.last_interval = None
+
+	def begin(self):
+		now = time.monotonic()
+		if self.last_start is not None:
+			interval = now - self.last_start
+			if self.last_interval is not None:
+				self.jitter += (abs(interval - self.last_interval) - self.jitter) / 16
+			self.last_interval = interval
+		self.last_start = now
+		self.flagged = False
+		self.started = now
+
+	def end(self):
+		duration = time.monotonic() - self.started
+		self.started = None
+		self.histogram[np.searchsorted(BUCKETS, duration)] += 1
+		self.decisions += 1
+		self.total += duration
+		self.worst = max(self.worst, duration)
+		if duration > self.deadline and not self.flagged:
+			self.overruns += 1
+		return duration
+
+	# Called by the watchdog. True the first time the decision in progress passes its deadline.
+	def overdue(self, now):
+		started = self.started
+		if started is None or self.flagged or now - started <= self.deadline:
+			return False
+		self.flagged = True
+		self.overruns += 1
+		return True
+
+	# Upper bound of the histogram bucket holding the given fraction of decisions.
+	def percentile(self, fraction):
+		if not self.decisions:
+			return None
+		bucket = np.searchsorted(np.cumsum(self.histogram), fraction * self.decisions)
+		return float(min(BUCKETS[bucket], self.worst))
+
+	# Totals as a flat list of floats, which a worker process copies into a shared array for main to show.
+	def counters(self):
+		return [self.decisions, self.total, self.worst, self.overruns, self.jitter] + self.histogram.tolist()
+
+	def load_counters(self, counters):
+		self.decisions, self.overruns = int(counters[0]), int(counters[3])
+		self.total, self.worst, self.jitter = counters[1], counters[2], counters[4]
+		self.histogram[:] = counters[5:COUNTERS]
+
+	def summary(self):
+		if not self.decisions:
+			return "no decisions"
+		return "%d decisions, mean %.1f ms, p95 %.1f ms, max %.1f ms, jitter %.1f ms, %d overruns" % (
+			self.decisions, 1000 * self.total / self.decisions, 1000 * self.percentile(0.95), 1000 * self.worst,
+			1000 * self.jitter, self.overruns)
+
+
+# One thread that watches every decision in progress and calls its overrun handler once the decision
+# passes its deadline, so a strategy that hangs still has its car brought to a stop.
+class DeadlineWatchdog():
+	def __init__(self):
+		self.watched = {}  # Profile -> overrun handler.
+		self.lock = threading.Lock()
+		self.thread = None
+
+	def watch(self, profile, on_overrun):
+		with self.lock:
+			self.watched[profile] = on_overrun
+			if self.thread is None:
+				self.thread = threading.Thread(target=self.run)
+				self.thread.daemon = True
+				self.thread.start()
+
+	def unwatch(self, profile):
+		with self.lock:
+			self.watched.pop(profile, None)
+
+	def run(self):
+		while True:
+			time.sleep(WATCHDOG_INTERVAL)
+			now = time.monotonic()
+			with self.lock:
+				watched = list(self.watched.items())
+			for profile, on_overrun in watched:
+				if profile.overdue(now):
+					on_overrun()
+
+	# A forked child inherits the watchdog without its thread, so it starts over watching its own decisions.
+	def _after_fork(self):
+		self.watched = {}
+		self.lock = threading.Lock()
+		self.thread = None
+
+
+watchdog = DeadlineWatchdog()
+if hasattr(os, "register_at_fork"):
+	os.register_at_fork(after_in_child=watchdog._after_fork)
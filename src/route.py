@@ -0,0 +1,119 @@
+import numpy as np
+from constants import *
+from geometry import bearing, heading_difference
+
+
+LOOKUP_CELL = 8  # Display pixels per cell of the nearest waypoint lookup grids.
+
+
+# A map's waypoint path with its geometry precomputed at load time. The path is a closed loop:
+# segment i runs from waypoint i to waypoint i + 1, and the last segment returns to waypoint 0.
+class Route():
+	def __init__(self, waypoints, width=DISPLAY_WIDTH, height=DISPLAY_HEIGHT):
+		self.waypoints = np.array(waypoints, dtype=np.float64).reshape(-1, 2)
+		self.segments = np.roll(self.waypoints, -1, axis=0) - self.waypoints  # Segment vectors.
+		self.segment_lengths = np.hypot(self.segments[:, 0], self.segments[:, 1])
+		self.cumulative = np.concatenate(([0.0], np.cumsum(self.segment_lengths)))  # Arc length at each waypoint.
+		self.length = float(self.cumulative[-1])
+		self.headings = bearing(self.waypoints, np.roll(self.waypoints, -1, axis=0))  # Clockwise from north.
+		self.curvature = self._curvature()  # Signed, per waypoint, in radians per world pixel. Positive turns right.
+
+		self.cols = int(np.ceil(width / LOOKUP_CELL))
+		self.rows = int(np.ceil(height / LOOKUP_CELL))
+		self.nearest_waypoint_grid = None
+		self.nearest_segment_grid = None
+		if len(self.waypoints):
+			self._build_lookup()
+
+	def __len__(self):
+		return len(self.waypoints)
+
+	# Turn at each waypoint spread over the mean length of the segments either side of it.
+	def _curvature(self):
+		if len(self.waypoints) < 3:
+			return np.zeros(len(self.waypoints))
+		turn = heading_difference(self.headings, np.roll(self.headings, 1))
+		span = np.maximum((self.segment_lengths + np.roll(self.segment_lengths, 1)) / 2, 1e-9)
+		return np.radians(turn) / span
+
+	# For the centre of every lookup cell, find the nearest waypoint and the nearest segment.
+	def _build_lookup(self):
+		xs = (np.arange(self.cols) + 0.5) * LOOKUP_CELL
+		ys = (np.arange(self.rows) + 0.5) * LOOKUP_CELL
+		centres = np.stack(np.meshgrid(xs, ys), axis=-1).reshape(-1, 1, 2)
+
+		offsets = centres - self.waypoints  # cells x waypoints x 2
+		waypoint_distances = np.einsum('ijk,ijk->ij', offsets, offsets)
+		self.nearest_waypoint_grid = np.argmin(waypoint_distances, axis=1).astype(np.int32).reshape(self.rows, self.cols)
+
+		squared_lengths = np.maximum(self.segment_lengths ** 2, 1e-9)
+		t = np.clip(np.einsum('ijk,jk->ij', offsets, self.segments) / squared_lengths, 0, 1)
+		closest = self.waypoints + t[:, :, None] * self.segments
+		segment_distances = np.sum((centres - closest) ** 2, axis=2)
+		self.nearest_segment_grid = np.argmin(segment_distances, axis=1).astype(np.int32).reshape(self.rows, self.cols)
+
+	def _cell(self, x, y):
+		col = min(max(int(x // LOOKUP_CELL), 0), self.cols - 1)
+		row = min(max(int(y // LOOKUP_CELL), 0), self.rows - 1)
+		return row, col
+
+	# Index of the waypoint nearest to (x, y).
+	def nearest_waypoint(self, x, y):
+		if not len(self.waypoints):
+			return None
+		return int(self.nearest_waypoint_grid[self._cell(x, y)])
+
+	# Index of the segment nearest to (x, y).
+	def nearest_segment(self, x, y):
+		if not len(self.waypoints):
+			return None
+		return int(self.nearest_segment_grid[self._cell(x, y)])
+
+	# Distance travelled along the route to the point on it nearest (x, y).
+	def progress(self, x, y):
+		segment = self.nearest_segment(x, y)
+		if segment is None:
+			return None
+		length = self.segment_lengths[segment]
+		if length == 0:
+			return float(self.cumulative[segment])
+		start = self.waypoints[segment]
+		t = ((x - start[0]) * self.segments[segment, 0] + (y - start[1]) * self.segments[segment, 1]) / (length * length)
+		return float(self.cumulative[segment] + min(max(t, 0), 1) * length)
+
+	# Fraction of a lap completed at (x, y), in [0, 1).
+	def lap_fraction(self, x, y):
+		progress = self.progress(x, y)
+		if progress is None or self.length == 0:
+			return None
+		return (progress / self.length) % 1
+
+	# Vectorised progress for an N x 2 array of points. Returns (arc lengths, segment indices).
+	def project(self, points):
+		points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+		cols = np.clip((points[:, 0] // LOOKUP_CELL).astype(np.int64), 0, self.cols - 1)
+		rows = np.clip((points[:, 1] // LOOKUP_CELL).astype(np.int64), 0, self.rows - 1)
+		segments = self.nearest_segment_grid[rows, cols]
+		lengths = np.maximum(self.segment_lengths[segments], 1e-9)
+		offsets = points - self.waypoints[segments]
+		t = np.clip(np.einsum('ij,ij->i', offsets, self.segments[segments]) / (lengths * lengths), 0, 1)
+		return self.cumulative[segments] + t * self.segment_lengths[segments], segments
+
+	# Vectorised inverse of project: the points at the given arc lengths, wrapping around the loop.
+	def point_at(self, arc_lengths):
+		arc_lengths = np.asarray(arc_lengths, dtype=np.float64) % max(self.length, 1e-9)
+		segments = np.clip(np.searchsorted(self.cumulative, arc_lengths, side='right') - 1, 0, len(self.waypoints) - 1)
+		t = (arc_lengths - self.cumulative[segments]) / np.maximum(self.segment_lengths[segments], 1e-9)
+		return self.waypoints[segments] + t[:, None] * self.segments[segments]
+
+	# Largest absolute curvature over the stretch of route from each arc length to arc length + distance.
+	def max_curvature_ahead(self, arc_lengths, distance):
+		arc_lengths = np.asarray(arc_lengths, dtype=np.float64)
+		if self.length == 0:
+			return np.zeros(len(arc_lengths))
+		ahead = (self.cumulative[None, :-1] - arc_lengths[:, None]) % self.length  # Cars x waypoints.
+		within = ahead <= np.broadcast_to(distance, arc_lengths.shape)[:, None]
+		return np.where(within, np.abs(self.curvature), 0).max(axis=1)
+
+	def next_index(self, index):
+		return (index + 1) % len(self.waypoints)
@@ -0,0 +1,60 @@
+import numpy as np
+
+
+CELL_SIZE = 64  # World pixels per grid cell, about one car length.
+
+
+# Uniform grid of vehicle IDs. Grids are never modified in place: moved() returns a new grid, so a grid can
+# be published inside a snapshot. The new grid shares every untouched cell's ID set with this one.
+class SpatialGrid():
+	def __init__(self, cells=None, locations=None, cell_size=CELL_SIZE):
+		self.cells = cells if cells is not None else {}  # (cx, cy) -> frozenset of IDs.
+		self.locations = locations if locations is not None else {}  # ID -> (cx, cy).
+		self.cell_size = cell_size
+
+	def cell_of(self, position):
+		return (int(position[0] // self.cell_size), int(position[1] // self.cell_size))
+
+	# Apply {ID: position or None} for the vehicles that changed. The cell and location dicts are shallow
+	# copied, which costs one entry per vehicle: cheap for the handful of cars on the table.
+	def moved(self, positions):
+		if not positions:
+			return self
+		cells = dict(self.cells)
+		locations = dict(self.locations)
+		for ID, position in positions.items():
+			old = locations.pop(ID, None)
+			new = None if position is None else self.cell_of(position)
+			if new is not None:
+				locations[ID] = new
+			if old == new:
+				continue
+			if old is not None:
+				remaining = cells[old] - {ID}
+				if remaining:
+					cells[old] = remaining
+				else:
+					del cells[old]
+			if new is not None:
+				cells[new] = cells.get(new, frozenset()) | {ID}
+		return SpatialGrid(cells, locations, self.cell_size)
+
+	# IDs in every cell touched by the square of half size radius around (x, y).
+	def candidates(self, x, y, radius):
+		x0, y0 = self.cell_of((x - radius, y - radius))
+		x1, y1 = self.cell_of((x + radius, y + radius))
+		found = []
+		if (x1 - x0 + 1) * (y1 - y0 + 1) > len(self.cells):  # Cheaper to walk the occupied cells.
+			for (cx, cy), IDs in self.cells.items():
+				if x0 <= cx <= x1 and y0 <= cy <= y1:
+					found.extend(IDs)
+			return found
+		for cx in range(x0, x1 + 1):
+			for cy in range(y0, y1 + 1):
+				IDs = self.cells.get((cx, cy))
+				if IDs:
+					found.extend(IDs)
+		return found
+
+	def __len__(self):
+		return len(self.locations)
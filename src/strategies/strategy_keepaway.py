@@ -4,23 +4,28 @@ STRATEGY_KEEPAWAY
 Agent tries to keep away from the walls.
 """
 
+import math
+
+WALL_MARGIN = 0.6  # Fraction of the map's road clearance (its half width) below which the agent turns away.
+
 def make_decision(self):
-	if "dimensions" not in self.worldKnowledge.keys():
-		self.worldKnowledge['dimensions'] = None
+	if self.vehicle.position is None:
+		self.vehicle.stop()
 		return
 
 	self.vehicle.set_speed(10)
 
-	width, height = self.worldKnowledge['dimensions']
-
-	TOO_FAR_NORTH = self.vehicle.position[1] - (height / 4) < 0
-	TOO_FAR_EAST = self.vehicle.position[0] + (width / 4) > width
-	TOO_FAR_SOUTH = self.vehicle.position[1] + (height / 4) > height
-	TOO_FAR_WEST = self.vehicle.position[0] - (width / 4) < 0
+	x, y = self.vehicle.position
+	clearance = self.world.clearance(x, y)
 
-	if TOO_FAR_NORTH or TOO_FAR_EAST or TOO_FAR_SOUTH or TOO_FAR_WEST:
-		self.vehicle.set_angle(40)
+	if clearance is not None and clearance < WALL_MARGIN * self.world['field'].road_clearance:
+		# Steer up the distance field, straight away from the nearest wall.
+		dx, dy = self.world.clearance_gradient(x, y)
+		if dx or dy:
+			self.aim_angle(math.degrees(math.atan2(dx, -dy)) % 360)
+		else:
+			self.vehicle.set_angle(40)
 		self.vehicle.headlights_on()
 	else:
 		self.vehicle.set_angle(0)
-		self.vehicle.headlights_off()
\ No newline at end of file
+		self.vehicle.headlights_off()
@@ -0,0 +1,148 @@
+import queue
+import numpy as np
+from threading import Thread
+from multiprocessing import Process, Event, Queue, Array
+from tracker.state_table import StateTable, make_rows
+from profiling import COUNTERS
+
+
+msgHeader = "[STRATEGY PROCESS]: "
+
+STOP_TIMEOUT = 1.0  # Seconds a worker gets to finish its last decision before it is terminated.
+POLL_INTERVAL = 0.1  # Seconds between checks for a stop request while no snapshots arrive.
+
+STATIC_KEYS = ('dimensions', 'waypoints', 'route', 'field')  # World data copied to the worker once.
+
+
+# Runs an agent's strategy in a worker process, so CPU-heavy decisions don't compete with the main loop
+# for the GIL. Vehicle poses reach the worker through a shared-memory state table, one row per vehicle,
+# and the vehicle commands it queues come back through a multiprocessing queue. The worker's decision
+# timings come back through a small shared array.
+class StrategyProcess():
+	def __init__(self, agent, strategyFile):
+		self.agent = agent
+		self.strategyFile = strategyFile
+		self.table = None
+		self.commands = Queue()
+		self.stop_event = Event()
+		self.counters = Array('d', COUNTERS)  # The worker's DecisionProfile.counters().
+		self.worker = None
+		self.forwarder = None
+
+	def start(self, snapshot):
+		vehicles = snapshot['vehicles']
+		# Row i of the table is vehicle i of the snapshot, so only row indices travel through shared memory.
+		self.table = StateTable(capacity=len(vehicles))
+		peers = [(vehicle.owner.ID, type(vehicle).__name__) for vehicle in vehicles]
+		static = {key: snapshot[key] for key in STATIC_KEYS}
+		self.publish(snapshot)
+		self.worker = Process(target=run_strategy,
+							  args=(self.agent.ID, self.strategyFile, peers, static, self.agent.min_interval,
+									self.agent.idle_interval, self.agent.profile.deadline, self.table, self.commands,
+									self.counters, self.stop_event))
+		self.worker.daemon = True
+		self.worker.start()
+		self.forwarder = Thread(target=self.forward_commands)
+		self.forwarder.daemon = True
+		self.forwarder.start()
+		print(msgHeader + "Started a worker process for Agent " + self.agent.ID + ".")
+
+	# Main process side. Writes the snapshot's poses to the state table, which wakes the worker.
+	def publish(self, snapshot):
+		if self.table is None:
+			return
+		rows = make_rows(len(snapshot.ids))
+		rows["id"] = np.arange(len(snapshot.ids))
+		rows["x"] = snapshot.poses[:, 0]
+		rows["y"] = snapshot.poses[:, 1]
+		rows["heading"] = snapshot.poses[:, 2]
+		rows["confidence"] = 1.0 if snapshot.tracking_healthy else 0.0
+		rows["frame_seq"] = snapshot.frame
+		rows["capture_ts"] = snapshot.capture_times()
+		self.table.write(rows)
+
+	# Hand commands from the worker to the real vehicle, whose queue the Bluetooth thread drains.
+	def forward_commands(self):
+		while True:
+			try:
+				command = self.commands.get(timeout=POLL_INTERVAL)
+			except queue.Empty:
+				if self.stop_event.is_set() and not self.worker.is_alive():
+					return
+				continue
+			self.agent.vehicle.queueCommand(command)
+
+	# The agent's decision timings, as last reported by the worker.
+	def decision_profile(self):
+		with self.counters.get_lock():
+			counters = self.counters[:]
+		self.agent.profile.load_counters(counters)
+		return self.agent.profile
+
+	def stop(self):
+		self.stop_event.set()
+		if self.worker is None:
+			return
+		self.worker.join(STOP_TIMEOUT)
+		if self.worker.is_alive():
+			print(msgHeader + "Terminating the worker process for Agent " + self.agent.ID + ".")
+			self.worker.terminate()
+			self.worker.join()
+		self.forwarder.join(STOP_TIMEOUT)
+
+
+# Worker process side. Mirrors the main process world from the state table and runs an ordinary agent on it.
+def run_strategy(ID, strategyFile, peers, static, min_interval, idle_interval, deadline, table, commands, counters,
+				 stop_event):
+	from agent import Agent
+	from world import World
+	from strategy_registry import registry
+
+	registry.keep_only(strategyFile)
+	agents = []
+	agent = None
+	for peerID, vehicleType in peers:
+		if peerID == ID:
+			agent = Agent(ID, vehicleType=vehicleType, strategyFile=strategyFile, deadline=deadline, process=False)
+			agent.min_interval = min_interval
+			agent.idle_interval = idle_interval
+			agent.vehicle.queueCommand = commands.put
+			agents.append(agent)
+		else:
+			agents.append(Agent(peerID, vehicleType=vehicleType))
+	vehicles = [peer.vehicle for peer in agents]
+	# Map images are pygame surfaces, which can't cross processes and aren't needed to decide.
+	world = World(agents, vehicles, None, static['waypoints'], static['route'], static['field'])
+	ids = world.ids
+
+	since = -1
+	started = False
+	while not stop_event.is_set():
+		report_profile(agent, counters)
+		module = registry.poll().get(strategyFile)
+		if module is not None:
+			agent.set_strategy(module)
+		generation = table.wait_for_update(since, POLL_INTERVAL)
+		if generation is None:
+			continue
+		since, rows = table.read()
+		car_locations = []
+		for row in rows:
+			located = not np.isnan(row["x"])
+			car_locations.append({'ID': ids[row["id"]],
+								  'position': (row["x"], row["y"]) if located else None,
+								  'orientation': None if np.isnan(row["heading"]) else float(row["heading"]),
+								  'timestamp': float(row["capture_ts"])})
+		world.update(car_locations)
+		world.set_tracking_healthy(bool(len(rows) and rows[0]["confidence"] > 0))
+		agent.update_world_knowledge(world.get_world_data())
+		if not started:
+			agent.start()
+			started = True
+	agent.stop()
+	report_profile(agent, counters)
+
+
+def report_profile(agent, counters):
+	with counters.get_lock():
+		counters[:] = agent.profile.counters()
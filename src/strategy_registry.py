@@ -0,0 +1,95 @@
+import os
+import time
+import threading
+import traceback
+from importlib import util
+
+
+msgHeader = "[STRATEGIES]: "
+
+POLL_INTERVAL = 1.0  # Seconds between checks of the strategy files for changes.
+
+
+class StrategyError(Exception):
+	pass
+
+
+# Compiles each strategy file once and shares the module between every agent that uses it. The files that
+# have been loaded are watched by polling their modification times, and edited ones are recompiled for a
+# hot-swap. New files in the strategies directory aren't picked up, as agents name their file up front.
+class StrategyRegistry():
+	def __init__(self):
+		self.modules = {}  # Path -> (modification time, module).
+		self.errors = {}  # Path -> traceback from the last failed compile, printed with the error.
+		self.last_poll = 0
+		self.lock = threading.Lock()  # Worker processes load in their own registry, but threads share this one.
+
+	# The module for a strategy file, compiled on first use or if the file has changed since.
+	# Raises StrategyError if the file is missing or broken.
+	def load(self, path):
+		with self.lock:
+			try:
+				mtime = os.path.getmtime(path)
+			except OSError as e:
+				raise StrategyError("Could not find " + path + ": " + str(e))
+			if path in self.modules and self.modules[path][0] == mtime:
+				return self.modules[path][1]
+			module = self._compile(path)
+			self.modules[path] = (mtime, module)
+			return module
+
+	# Recompile strategy files changed since they were loaded. Returns {path: new module} for the ones that
+	# compiled; a broken edit keeps the previous module running and is reported instead.
+	def poll(self):
+		now = time.monotonic()
+		if now - self.last_poll < POLL_INTERVAL:
+			return {}
+		self.last_poll = now
+		swapped = {}
+		with self.lock:
+			for path, (mtime, module) in list(self.modules.items()):
+				try:
+					current = os.path.getmtime(path)
+				except OSError:  # Deleted or mid-save. Keep running the loaded version.
+					continue
+				if current == mtime:
+					continue
+				try:
+					module = self._compile(path)
+				except StrategyError as e:
+					print(msgHeader + str(e))
+					print(self.errors[path], end="")
+					self.modules[path] = (current, self.modules[path][1])  # Don't retry until it's edited again.
+					continue
+				self.modules[path] = (current, module)
+				swapped[path] = module
+				print(msgHeader + "Reloaded " + os.path.basename(path) + ".")
+		return swapped
+
+	# Stop watching every strategy file but path. A worker process forked from main starts out with all of
+	# main's modules, and must only ever swap in its own.
+	def keep_only(self, path):
+		with self.lock:
+			self.modules = {loaded: entry for loaded, entry in self.modules.items() if loaded == path}
+
+	# The lock may have been held by a parent thread at fork time, and that thread doesn't exist in the child.
+	def _after_fork(self):
+		self.lock = threading.Lock()
+
+	def _compile(self, path):
+		name = "strategy_" + os.path.splitext(os.path.basename(path))[0]
+		try:
+			spec = util.spec_from_file_location(name, path)
+			module = util.module_from_spec(spec)
+			spec.loader.exec_module(module)
+		except Exception as e:
+			message = "Could not load " + os.path.basename(path) + ": " + type(e).__name__ + ": " + str(e)
+			self.errors[path] = traceback.format_exc()
+			raise StrategyError(message)
+		self.errors.pop(path, None)
+		return module
+
+
+registry = StrategyRegistry()
+if hasattr(os, "register_at_fork"):
+	os.register_at_fork(after_in_child=registry._after_fork)
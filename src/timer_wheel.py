@@ -0,0 +1,109 @@
+import os
+import math
+import time
+import threading
+
+
+msgHeader = "[TIMERS]: "
+
+TICK = 0.01  # Seconds per wheel slot.
+SLOTS = 512  # One turn of the wheel covers SLOTS * TICK seconds; later timers stay put for extra turns.
+
+
+class Timer():
+	__slots__ = ('tick', 'callback', 'args', 'cancelled')
+
+	def __init__(self, tick, callback, args):
+		self.tick = tick  # Wheel tick at which the timer fires.
+		self.callback = callback
+		self.args = args
+		self.cancelled = False
+
+	def cancel(self):
+		self.cancelled = True
+
+
+# Hashed timer wheel. Scheduling and cancelling are O(1), and a single thread fires every timer, to within
+# one tick. The thread sleeps until the next tick while timers are pending and blocks while none are.
+class TimerWheel():
+	def __init__(self, tick=TICK, slots=SLOTS):
+		self.tick = tick
+		self.slots = [[] for _ in range(slots)]
+		self.start = time.monotonic()
+		self.current = 0  # Last tick serviced.
+		self.pending = 0
+		self.lock = threading.Lock()
+		self.wakeup = threading.Event()
+		self.thread = None
+
+	# Call callback(*args) after delay seconds, from the timer thread. Returns a Timer that can be cancelled.
+	def schedule(self, delay, callback, *args):
+		with self.lock:
+			target = max(self._now_tick(), self.current) + max(1, math.ceil(delay / self.tick))
+			timer = Timer(target, callback, args)
+			self.slots[target % len(self.slots)].append(timer)
+			self.pending += 1
+			if self.thread is None:
+				self.thread = threading.Thread(target=self.run)
+				self.thread.daemon = True
+				self.thread.start()
+		self.wakeup.set()
+		return timer
+
+	def _now_tick(self):
+		return int((time.monotonic() - self.start) / self.tick)
+
+	def run(self):
+		while True:
+			with self.lock:
+				idle = self.pending == 0
+			if idle:
+				self.wakeup.wait()
+				self.wakeup.clear()
+				with self.lock:
+					self.current = max(self.current, self._now_tick() - 1)  # Nothing was due while idle.
+				continue
+			delay = self.start + (self.current + 1) * self.tick - time.monotonic()
+			if delay > 0:
+				time.sleep(delay)
+			for timer in self._advance():
+				try:
+					timer.callback(*timer.args)
+				except Exception as e:
+					print(msgHeader + "Timed action failed: " + str(e))
+
+	# Service every slot up to now, returning the timers due.
+	def _advance(self):
+		due = []
+		with self.lock:
+			now = self._now_tick()
+			while self.current < now:
+				self.current += 1
+				slot = self.slots[self.current % len(self.slots)]
+				if not slot:
+					continue
+				waiting = []
+				for timer in slot:
+					if timer.tick > self.current:  # Due on a later turn of the wheel.
+						waiting.append(timer)
+						continue
+					self.pending -= 1
+					if not timer.cancelled:
+						due.append(timer)
+				slot[:] = waiting
+		return due
+
+	# A forked child, such as a strategy worker process, inherits the wheel but not its thread, and maybe a
+	# lock held by a thread that doesn't exist there. The parent's timers aren't the child's to fire either,
+	# so the child starts with an empty wheel.
+	def _after_fork(self):
+		self.slots = [[] for _ in self.slots]
+		self.pending = 0
+		self.lock = threading.Lock()
+		self.wakeup = threading.Event()
+		self.thread = None
+
+
+timers = TimerWheel()
+if hasattr(os, "register_at_fork"):
+	os.register_at_fork(after_in_child=timers._after_fork)
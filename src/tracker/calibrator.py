@@ -1,5 +1,6 @@
 from tracker.core import *
 from constants import *
+from tracker.transform import Transform
 
 msgHeader = "[CALIBRATOR]: "
 
@@ -32,23 +33,9 @@ class Calibrator:
 			return None, None
 
 	def calculate_corners(self, pc, mat):
-		xMin = None
-		xMax = None
-		yMin = None
-		yMax = None
-		for p in pc:
-			point = np.matrix([p[0], p[1], 1]).T
-			hPoint = np.dot(mat, point)
-			x = hPoint[0]
-			y = hPoint[1]
-			if xMin is None or x < xMin:
-				xMin = int(x)
-			if xMax is None or x > xMax:
-				xMax = int(x)
-			if yMin is None or y < yMin:
-				yMin = int(y)
-			if yMax is None or y > yMax:
-				yMax = int(y)
+		world = Transform(mat).camera_to_world(pc)
+		xMin, yMin = [int(v) for v in world.min(axis=0)]
+		xMax, yMax = [int(v) for v in world.max(axis=0)]
 
 		sw = int((xMin - xMax) / 9)
 
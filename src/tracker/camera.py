@@ -1,4 +1,5 @@
 from tracker.core import *
+import threading
 from threading import Thread
 from multiprocessing import Process, Queue
 from sys import argv
@@ -87,13 +88,28 @@ class OldCamera:
 
 
 class Camera():
-	def __init__(self, source=None):
+	def __init__(self, source=None, threaded=False):
 		if source is not None:
 			# Check if specified source exists.
 			if not Path(source).exists():
 				print(header + "Error - path '" + str(source) + "' does not exist.")
 				return
 
+		self.threaded = threaded
+		if threaded:
+			# Capture on a thread in this process. Frames are handed over by reference, no pickling.
+			self.frame = None
+			self.frame_count = 0
+			self.delivered_count = 0
+			self.frame_ready = threading.Condition()
+			self.stopped = False
+			self.worker = Thread(target=self.read_frames_threaded, args=(source,))
+			self.worker.daemon = True
+			self.worker.start()
+			with self.frame_ready: # Wait for camera to activate.
+				self.frame_ready.wait_for(lambda: self.frame_count > 0)
+			return
+
 		self.killQueue = Queue(maxsize=1)
 		self.framebuffer = Queue(maxsize=1)
 		self.worker = Process(target=self.read_frames, args=(source, self.framebuffer, self.killQueue,))
@@ -157,7 +173,38 @@ class Camera():
 					framebuffer.put(frame)
 		return
 
+	def read_frames_threaded(self, source):
+		if source is None: # Reading from webcam.
+			os.system(camSetupScript)
+			stream = cv2.VideoCapture(0)
+			stream.set(cv2.CAP_PROP_FRAME_WIDTH, CAPTURE_WIDTH)
+			stream.set(cv2.CAP_PROP_FRAME_HEIGHT, CAPTURE_HEIGHT)
+		else: # Reading from video file.
+			stream = cv2.VideoCapture(source)
+		lastTime = time.time()
+		while not self.stopped:
+			if source is not None: # Fake 30 fps stream.
+				wait = lastTime + 1 / 30 - time.time()
+				if wait > 0:
+					time.sleep(wait)
+				lastTime = time.time()
+			ret, frame = stream.read()
+			if not ret or frame is None: continue
+			with self.frame_ready:
+				self.frame = frame
+				self.frame_count += 1
+				self.frame_ready.notify_all()
+		stream.release()
+
 	def get_frame(self):
+		if self.threaded:
+			with self.frame_ready: # Block until a frame newer than the last one delivered is available.
+				if not self.frame_ready.wait_for(lambda: self.frame_count > self.delivered_count, 0.5):
+					print("\n\n\nRan out of frames.\n\n\n")
+					return None
+				self.delivered_count = self.frame_count
+				return self.frame
+
 		start = time.time()
 		while self.framebuffer.empty(): # Block until a frame is available.
 			timeElapsed = time.time() - start
@@ -170,6 +217,10 @@ class Camera():
 		return frame
 
 	def stop_camera(self):
+		if self.threaded:
+			self.stopped = True
+			self.worker.join()
+			return
 		self.killQueue.put("KILL")
 		self.worker.join()
 
@@ -0,0 +1,79 @@
+"""
+
+LIGHT_IDENTIFIER.PY
+Identifies cars by flashing their lights in a distinct temporal code and watching the blobs.
+
+"""
+
+from tracker.core import *
+
+msgHeader = "[LIGHT IDENTIFIER]: "
+
+SLOT_TIME = 0.12  # Seconds each light state is held, enough for the Bluetooth send and a fresh frame.
+ROI_RADIUS = 10  # Half size in camera pixels of the square sampled around each blob.
+MIN_CONTRAST = 6  # Minimum brightness difference between the two halves of a bit.
+
+
+class LightIdentifier():
+	def __init__(self, camera):
+		self.camera = camera
+
+	# Match each camera position to one of the agents. Returns a list of agents in the same order as
+	# positions, or None if the code could not be read cleanly.
+	def identify(self, agents, positions):
+		codes = assign_codes(len(agents))
+		bits = len(codes[0])
+
+		# Each bit is sent Manchester style, on then off for a 1 and off then on for a 0, so a bit is read by
+		# comparing two frames of the same blob rather than against a fixed threshold.
+		brightness = np.zeros((len(positions), bits, 2))
+		try:
+			for bit in range(bits):
+				for phase in range(2):
+					for agent, code in zip(agents, codes):
+						self._set_lights(agent.vehicle, code[bit] == (phase == 0))
+					time.sleep(SLOT_TIME)
+					frame = self.camera.get_frame()
+					if frame is None:
+						return None
+					brightness[:, bit, phase] = self._measure(frame, positions)
+		finally:
+			for agent in agents:
+				self._set_lights(agent.vehicle, False)
+
+		contrast = brightness[:, :, 0] - brightness[:, :, 1]
+		if np.min(np.abs(contrast)) < MIN_CONTRAST:
+			print(msgHeader + "Light signature too faint to read.")
+			return None
+
+		observed = [tuple(row) for row in (contrast > 0).astype(int)]
+		lookup = {tuple(code): agent for code, agent in zip(codes, agents)}
+		matched = [lookup.get(code) for code in observed]
+		if None in matched or len(set(matched)) != len(matched):
+			print(msgHeader + "Light signatures did not match the enabled cars.")
+			return None
+		return matched
+
+	def _set_lights(self, vehicle, on):
+		if on:
+			vehicle.headlights_on()
+			vehicle.left_signal_on()
+		else:
+			vehicle.headlights_off()
+			vehicle.left_signal_off()
+
+	def _measure(self, frame, positions):
+		gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+		height, width = gray.shape
+		values = []
+		for x, y in positions:
+			x0, x1 = max(0, x - ROI_RADIUS), min(width, x + ROI_RADIUS)
+			y0, y1 = max(0, y - ROI_RADIUS), min(height, y + ROI_RADIUS)
+			values.append(np.mean(gray[y0:y1, x0:x1]))
+		return values
+
+
+# Distinct binary codes, just long enough to tell count cars apart.
+def assign_codes(count):
+	bits = max(1, int(np.ceil(np.log2(max(count, 2)))))
+	return [[(i >> b) & 1 for b in range(bits)] for i in range(count)]
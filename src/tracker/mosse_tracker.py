@@ -13,6 +13,7 @@ class MOSSETracker():
 			entity.tracker.init(initFrame, bb)
 
 		self.orientationFinder = OrientationFinder()
+		self.lost = []  # Entities that were lost on the last frame and could not be re-detected.
 
 	def process(self, image):
 		copy = image.copy()
@@ -73,4 +74,5 @@ class MOSSETracker():
 					entity.tracker.init(image, bb)
 					print("Re-detected " + pair[1].ID)
 
+		self.lost = [entity for entity in lostEntities if entity not in owned]
 		return self.entities
\ No newline at end of file
@@ -1,4 +1,5 @@
 from tracker.core import *
+from geometry import bearing
 
 
 
@@ -46,27 +47,7 @@ class OrientationFinder():
 			if abs(dx) < 5 and abs(dy) < 5:
 				theta = self.last_angles[car_id]
 			else:
-				theta = 0
-				if (dx != 0):
-					theta = atan(dy / dx) * (180 / pi)
-				if (dx == 0):
-					if (dy <= 0):
-						theta = 0
-					else:
-						theta = 180
-				elif (dy == 0):
-					if (dx < 0):
-						theta = 90
-					else:
-						theta = 270
-				elif (dx > 0 and dy > 0):
-					theta = theta + 90
-				elif (dx > 0 and dy < 0):
-					theta = theta + 90
-				elif (dx < 0 and dy > 0):
-					theta = theta + 270
-				elif (dx < 0 and dy < 0):
-					theta = theta + 270
+				theta = bearing(self.last_locations[car_id], car_position)
 
 				# Handle reversing.
 				if self.last_angles[car_id] is not None:
@@ -0,0 +1,154 @@
+"""
+
+RECALIBRATOR.PY
+Watches for camera or projector drift during a session and re-estimates the homography.
+
+"""
+
+from tracker.core import *
+from tracker.transform import Transform
+from constants import *
+import threading
+
+msgHeader = "[RECALIBRATOR]: "
+
+RECALIBRATION_INTERVAL = 15  # Frames between drift checks.
+DRIFT_THRESHOLD = 4.0  # Mean error in world pixels before a new homography is swapped in.
+DRIFT_CONFIRMATIONS = 3  # Consecutive checks over the threshold before swapping, so one bad estimate can't.
+FEATURE_COUNT = 80  # Sparse features followed between the reference and current frames.
+MIN_FEATURES = 12
+MIN_INLIER_RATIO = 0.6  # Fraction of the followed features RANSAC must agree on for an estimate to count.
+DOWNSCALE = 0.5  # Drift checks run on a half resolution greyscale frame.
+ENTITY_MASK_RADIUS = 60  # World pixels around each car kept free of features, as cars and their markers move.
+
+# Display areas, in world pixels (x0, y0, x1, y1), whose projected text changes during a session: the race
+# timer and lap times, the tracking warning, and the DEBUG readouts. Features aren't picked in them.
+OVERLAY_REGIONS = ((780, 0, DISPLAY_WIDTH, DISPLAY_HEIGHT / 2),
+				   (0, 0, DISPLAY_WIDTH * 0.75, 200),
+				   (0, DISPLAY_HEIGHT - 250, DISPLAY_WIDTH * 0.75, DISPLAY_HEIGHT))
+
+
+class Recalibrator():
+	# entityPositions are the cars' camera pixel positions in the reference frame.
+	def __init__(self, transform, referenceFrame, entityPositions=(), on_swap=None):
+		self.transform = transform
+		self.base_matrix = transform.get_matrix()  # Camera -> world at the time the reference frame was taken.
+		self.on_swap = on_swap
+
+		self.reference = self._prepare(referenceFrame)
+		mask = self._static_mask(entityPositions)
+		self.reference_points = cv2.goodFeaturesToTrack(self.reference, FEATURE_COUNT, 0.01, 10, mask=mask)
+
+		# Probe grid across the display area, used to measure drift in world pixels.
+		xs, ys = np.meshgrid(np.linspace(0, DISPLAY_WIDTH, 5), np.linspace(0, DISPLAY_HEIGHT, 5))
+		self.probe = np.column_stack((xs.ravel(), ys.ravel()))
+
+		self.drift = 0.0
+		self.confirmations = 0  # Consecutive checks with drift over the threshold.
+		self.swaps = 0
+		self.frame_count = 0
+		self.pending = None
+		self.frame_ready = threading.Event()
+		self.stopped = False
+
+	def start(self):
+		t_process = threading.Thread(target=self.update)
+		t_process.daemon = True
+		t_process.start()
+		return self
+
+	def stop(self):
+		self.stopped = True
+		self.frame_ready.set()
+
+	# Called once per tracked frame. Only every RECALIBRATION_INTERVAL frames is handed to the background thread.
+	def process(self, image):
+		self.frame_count += 1
+		if self.reference_points is None or len(self.reference_points) < MIN_FEATURES:
+			return
+		if self.frame_count % RECALIBRATION_INTERVAL != 0 or self.frame_ready.is_set():
+			return  # Skip this check if the previous one is still running.
+		self.pending = self._prepare(image)
+		self.frame_ready.set()
+
+	def update(self):
+		_lower_thread_priority()
+		while True:
+			self.frame_ready.wait()
+			if self.stopped:
+				return
+			self._check(self.pending)
+			self.frame_ready.clear()
+
+	def _prepare(self, image):
+		gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+		return cv2.resize(gray, None, fx=DOWNSCALE, fy=DOWNSCALE, interpolation=cv2.INTER_AREA)
+
+	# Mask of the downscaled reference frame where features may be picked: everywhere but the cars and the
+	# projected overlays.
+	def _static_mask(self, entityPositions):
+		mask = np.full(self.reference.shape, 255, np.uint8)
+		scale = DOWNSCALE * self._camera_pixels_per_world_pixel()
+		for x, y in entityPositions:
+			cv2.circle(mask, (int(x * DOWNSCALE), int(y * DOWNSCALE)), int(ENTITY_MASK_RADIUS * scale), 0, -1)
+		for x0, y0, x1, y1 in OVERLAY_REGIONS:
+			corners = self.transform.world_to_camera([(x0, y0), (x1, y0), (x1, y1), (x0, y1)]) * DOWNSCALE
+			cv2.fillConvexPoly(mask, np.round(corners).astype(np.int32), 0)
+		return mask
+
+	def _camera_pixels_per_world_pixel(self):
+		corners = self.transform.world_to_camera([(0, 0), (DISPLAY_WIDTH, 0)])
+		return float(np.hypot(*(corners[1] - corners[0]))) / DISPLAY_WIDTH
+
+	def _check(self, gray):
+		try:
+			candidate = self._estimate(gray)
+			if candidate is None:
+				self.confirmations = 0
+				return
+			self.drift = self._measure(candidate)
+			if self.drift <= DRIFT_THRESHOLD:
+				self.confirmations = 0
+				return
+			self.confirmations += 1
+			if self.confirmations >= DRIFT_CONFIRMATIONS:
+				self.confirmations = 0
+				self.transform.set_matrix(candidate)
+				self.swaps += 1
+				print(msgHeader + "Drift of %.1f px detected, swapped in a new homography." % self.drift)
+				if self.on_swap is not None:
+					self.on_swap(candidate, self.drift)
+		except (cv2.error, np.linalg.LinAlgError) as e:
+			print(msgHeader + str(e))
+
+	# Estimate camera -> world for the current frame from the motion of the reference features.
+	def _estimate(self, gray):
+		points, status, _ = cv2.calcOpticalFlowPyrLK(self.reference, gray, self.reference_points, None)
+		if points is None:
+			return None
+		good = status.ravel() == 1
+		if np.count_nonzero(good) < MIN_FEATURES:
+			return None
+
+		# Features were found on the downscaled frame, so scale them back to camera pixels.
+		src = self.reference_points[good].reshape(-1, 2) / DOWNSCALE
+		dst = points[good].reshape(-1, 2) / DOWNSCALE
+		motion, inliers = cv2.findHomography(src, dst, cv2.RANSAC, 3.0)  # Reference camera -> current camera.
+		if motion is None or inliers is None or np.mean(inliers) < MIN_INLIER_RATIO:
+			return None
+		candidate = self.base_matrix.dot(np.linalg.inv(motion))
+		return candidate / candidate[2, 2]
+
+	# Mean world-space error of the homography in use, assuming the candidate is correct.
+	def _measure(self, candidate):
+		camera = Transform(candidate).world_to_camera(self.probe)
+		world = self.transform.camera_to_world(camera)
+		return float(np.mean(np.hypot(*(world - self.probe).T)))
+
+
+def _lower_thread_priority():
+	# Linux lets a single thread be reniced by its native id.
+	try:
+		os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 10)
+	except (AttributeError, OSError):
+		pass
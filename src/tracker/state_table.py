@@ -0,0 +1,112 @@
+"""
+
+STATE_TABLE.PY
+Fixed-layout shared-memory table of tracked entities.
+One process writes under a seqlock, any number of processes read without locking.
+
+"""
+
+from tracker.core import *
+import threading
+from multiprocessing import Condition
+from multiprocessing.sharedctypes import RawArray
+
+MAX_ENTITIES = 16
+
+ENTITY_DTYPE = np.dtype([("id", np.int32),
+						 ("x", np.float64),
+						 ("y", np.float64),
+						 ("heading", np.float64),
+						 ("confidence", np.float32),
+						 ("frame_seq", np.int64),
+						 ("capture_ts", np.float64)])
+
+NOTIFY_TIMEOUT = 0.05  # Readers fall back to their own timeouts if a notification can't be sent.
+READ_RETRIES = 1000  # Attempts before a reader stops waiting for a write that may never finish.
+
+SEQUENCE = 0  # Header slots.
+COUNT = 1
+
+
+class StateTable():
+	def __init__(self, capacity=MAX_ENTITIES, threaded=False):
+		self.capacity = capacity
+		self.threaded = threaded  # Writer and readers share a process, so a threading condition will do.
+		self.raw_header = RawArray('q', 2)
+		self.raw_rows = RawArray('b', capacity * ENTITY_DTYPE.itemsize)
+		self.reset_notifier()  # Notified after every completed write.
+		self._attach()
+
+	def _attach(self):
+		self.header = np.frombuffer(self.raw_header, dtype=np.int64)
+		self.rows = np.frombuffer(self.raw_rows, dtype=ENTITY_DTYPE)
+		self.last_read = (0, make_rows(0))  # Last consistent read by this process.
+
+	# NumPy views can't be pickled onto shared memory, so only the raw buffers travel to child processes.
+	def __getstate__(self):
+		return {"capacity": self.capacity, "threaded": self.threaded, "raw_header": self.raw_header,
+				"raw_rows": self.raw_rows, "updated": self.updated}
+
+	def __setstate__(self, state):
+		self.__dict__.update(state)
+		self._attach()
+
+	# Writer side. Only ever called from the tracking process.
+	def write(self, rows):
+		count = min(len(rows), self.capacity)
+		self.header[SEQUENCE] += 1  # Odd while a write is in progress.
+		self.rows[:count] = rows[:count]
+		self.header[COUNT] = count
+		self.header[SEQUENCE] += 1
+		if self.updated.acquire(True, NOTIFY_TIMEOUT):
+			self.updated.notify_all()
+			self.updated.release()
+
+	def clear(self):
+		self.write(np.zeros(0, dtype=ENTITY_DTYPE))
+
+	# Reader side. Returns (generation, copy of the rows), retrying if a write was in progress. A writer
+	# killed mid-write never finishes it, so after READ_RETRIES this returns the last consistent read, which
+	# looks like a stalled tracker to the supervisor.
+	def read(self):
+		for _ in range(READ_RETRIES):
+			start = int(self.header[SEQUENCE])
+			if start & 1:
+				time.sleep(0)
+				continue
+			rows = self.rows[:self.header[COUNT]].copy()
+			if int(self.header[SEQUENCE]) == start:
+				self.last_read = (start >> 1, rows)
+				break
+		return self.last_read
+
+	def generation(self):
+		return int(self.header[SEQUENCE]) >> 1
+
+	# Block until the generation moves past since. Returns the new generation, or None on timeout.
+	def wait_for_update(self, since, timeout=None):
+		updated = self.updated
+		acquired = updated.acquire() if timeout is None else updated.acquire(True, timeout)
+		if not acquired:
+			return None
+		try:
+			if not updated.wait_for(lambda: self.generation() > since, timeout):
+				return None
+		finally:
+			updated.release()
+		return self.generation()
+
+	# A writer killed while holding the notification lock would leave it locked, so a replacement writer
+	# gets a fresh one.
+	def reset_notifier(self):
+		self.updated = threading.Condition() if self.threaded else Condition()
+
+	# A writer killed mid-write leaves the sequence odd. Round it up before a replacement starts writing,
+	# or readers would take every completed write for one in progress.
+	def recover(self):
+		if self.header[SEQUENCE] & 1:
+			self.header[SEQUENCE] += 1
+
+
+def make_rows(count):
+	return np.zeros(count, dtype=ENTITY_DTYPE)
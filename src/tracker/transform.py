@@ -0,0 +1,49 @@
+"""
+
+TRANSFORM.PY
+Holds the calibrated homography and maps points between camera and world coordinates.
+
+"""
+
+from tracker.core import *
+
+
+class Transform():
+	def __init__(self, homo_matrix=None):
+		self.matrices = None  # (camera->world, world->camera), swapped as one reference.
+		if homo_matrix is not None:
+			self.set_matrix(homo_matrix)
+
+	def set_matrix(self, homo_matrix):
+		forward = np.asarray(homo_matrix, dtype=np.float64).reshape(3, 3)
+		inverse = np.linalg.inv(forward)
+		self.matrices = (forward, inverse)
+
+	def get_matrix(self):
+		matrices = self.matrices
+		if matrices is None:
+			return None
+		return matrices[0]
+
+	def is_calibrated(self):
+		return self.matrices is not None
+
+	# Map an N x 2 array of camera pixels to world coordinates.
+	def camera_to_world(self, points):
+		return self._apply(self.matrices[0], points)
+
+	# Map an N x 2 array of world coordinates to camera pixels.
+	def world_to_camera(self, points):
+		return self._apply(self.matrices[1], points)
+
+	def _apply(self, mat, points):
+		pts = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+		if len(pts) == 0:
+			return np.empty((0, 2))
+		# Homogeneous coordinates are (x, y, 1), so the product is pts @ M[:, :2].T + M[:, 2].
+		hPoints = pts.dot(mat[:, :2].T) + mat[:, 2]
+		return hPoints[:, :2] / hPoints[:, 2:3]
+
+
+def to_pixels(points):
+	return [(int(round(x)), int(round(y))) for x, y in points]
@@ -1,14 +1,23 @@
 import time
+import threading
+from collections import deque
 from zenwheels.protocol import *
+from world import current_snapshot
+from timer_wheel import timers
 
 msgHeader = " [VEHICLE]: "
 
+# On/off channels: (command, on value, off value). Each has a matching <channel>_active flag on Vehicle.
+CHANNELS = {"horn": (HORN, HORN_ON, HORN_OFF),
+			"headlights": (HEADLIGHT, HEADLIGHT_BRIGHT, HEADLIGHT_OFF),
+			"left_signal": (LEFT_SIGNAL, SIGNAL_FRONT_BRIGHT, SIGNAL_OFF),
+			"right_signal": (RIGHT_SIGNAL, SIGNAL_FRONT_BRIGHT, SIGNAL_OFF),
+			"police_siren": (EFFECTS, EFFECTS_POLICE_HILO, EFFECTS_OFF)}
+
 class Vehicle:
 	def __init__(self, owner):
 		# Vehicle properties.
 		self.owner = owner
-		self.position = None  # World coordinates (x, y).
-		self.orientation = None  # Degrees clockwise from north.
 		self.dimensions = None  # Size and shape (width, length).
 		self.max_speed = None
 		self.max_acceleration = None
@@ -24,9 +33,29 @@ class Vehicle:
 		self.left_signal_active = False
 		self.right_signal_active = False
 		self.police_siren_active = False
+		self.timed = {}  # Channel -> (token, Timer) of the pending action that switches or flashes it.
+		self.timed_lock = threading.Lock()  # Guards timed and the *_active flags, shared by agent and timer threads.
+		self.drive_held = False  # Steering and throttle are dropped until released, set when a decision overruns.
+		self.drive_lock = threading.Lock()  # Keeps a drive command from landing after the stop that held it.
+
+		# Commands to be sent to the corresponding ZenWheels car.
+		self.command_queue = CommandSlots()
 
-		# List of commands to be sent to the corresponding ZenWheels car.
-		self.command_queue = {}
+	# World coordinates (x, y), read from the snapshot pinned by the calling thread.
+	@property
+	def position(self):
+		snapshot = current_snapshot()
+		if snapshot is None:
+			return None
+		return snapshot.position(self.owner.ID)
+
+	# Degrees clockwise from north, read from the snapshot pinned by the calling thread.
+	@property
+	def orientation(self):
+		snapshot = current_snapshot()
+		if snapshot is None:
+			return None
+		return snapshot.orientation(self.owner.ID)
 
 	def get_orientation(self):
 		return self.orientation
@@ -38,81 +67,184 @@ class Vehicle:
 		if speed >= 0:  # Forwards.
 			if speed > 63:  # Maximum.
 				speed = 63
-			self.queueCommand(bytes([THROTTLE, speed]))
+			self.queueDrive(bytes([THROTTLE, speed]))
 		else:  # Backwards.
 			if speed < -64:  # Maximum.
 				speed = 64
 			else:
 				speed = 128 + speed
-			self.queueCommand(bytes([THROTTLE, speed]))
+			self.queueDrive(bytes([THROTTLE, speed]))
 
 	def set_angle(self, angle):
 		if angle >= 0:  # Steering right.
 			if angle > 63:  # Maximum.
 				angle = 63
-			self.queueCommand(bytes([STEERING, angle]))
+			self.queueDrive(bytes([STEERING, angle]))
 		else:  # Steering left.
 			if angle < -64:  # Maximum.
 				angle = 64
 			else:
 				angle = 128 + angle
-			self.queueCommand(bytes([STEERING, angle]))
+			self.queueDrive(bytes([STEERING, angle]))
 
 	def stop(self):
 		self.queueCommand(bytes([THROTTLE, 0]))
 
-	def horn_on(self):
-		if self.horn_active == False:
-			self.queueCommand(bytes([HORN, HORN_ON]))
-			self.horn_active = True
+	# Stop the car and drop steering and throttle commands until release_drive(). Called from the watchdog
+	# thread, so the rest of an overrunning decision can't overwrite the stop in the latest-wins slot.
+	def hold_drive(self):
+		with self.drive_lock:
+			self.drive_held = True
+			self.stop()
+
+	def release_drive(self):
+		with self.drive_lock:
+			self.drive_held = False
+
+	def horn_on(self, duration=None):
+		self.set_channel("horn", True, duration)
 
 	def horn_off(self):
-		if self.horn_active == True:
-			self.queueCommand(bytes([HORN, HORN_OFF]))
-			self.horn_active = False
+		self.set_channel("horn", False)
 
-	def headlights_on(self):
-		if self.headlights_active == False:
-			self.queueCommand(bytes([HEADLIGHT, HEADLIGHT_BRIGHT]))
-			self.headlights_active = True
+	def headlights_on(self, duration=None):
+		self.set_channel("headlights", True, duration)
 
 	def headlights_off(self):
-		if self.headlights_active == True:
-			self.queueCommand(bytes([HEADLIGHT, HEADLIGHT_OFF]))
-			self.headlights_active = False
+		self.set_channel("headlights", False)
 
-	def left_signal_on(self):
-		if self.left_signal_active == False:
-			self.queueCommand(bytes([LEFT_SIGNAL, SIGNAL_FRONT_BRIGHT]))
-			self.left_signal_active = True
+	def left_signal_on(self, duration=None):
+		self.set_channel("left_signal", True, duration)
 
 	def left_signal_off(self):
-		if self.left_signal_active == True:
-			self.queueCommand(bytes([LEFT_SIGNAL, SIGNAL_OFF]))
-			self.left_signal_active = False
+		self.set_channel("left_signal", False)
 
-	def right_signal_on(self):
-		if self.right_signal_active == False:
-			self.queueCommand(bytes([RIGHT_SIGNAL, SIGNAL_FRONT_BRIGHT]))
-			self.right_signal_active = True
+	def right_signal_on(self, duration=None):
+		self.set_channel("right_signal", True, duration)
 
 	def right_signal_off(self):
-		if self.right_signal_active == True:
-			self.queueCommand(bytes([RIGHT_SIGNAL, SIGNAL_OFF]))
-			self.right_signal_active = False
-			
-	def police_siren_on(self):
-		if self.police_siren_active == False:
-			self.queueCommand(bytes([EFFECTS, EFFECTS_POLICE_HILO]))
-			self.police_siren_active = True
-			
+		self.set_channel("right_signal", False)
+
+	def police_siren_on(self, duration=None):
+		self.set_channel("police_siren", True, duration)
+
 	def police_siren_off(self):
-		if self.police_siren_active == True:
-			self.queueCommand(bytes([EFFECTS, EFFECTS_OFF]))
-			self.police_siren_active = False
+		self.set_channel("police_siren", False)
+
+	# Switch a channel on or off, replacing any timed action on it. With a duration, the channel is switched
+	# back off by the timer wheel that many seconds later, without blocking the caller.
+	def set_channel(self, channel, active, duration=None):
+		with self.timed_lock:
+			self._cancel_timed(channel)
+			self._switch(channel, active)
+			if active and duration is not None:
+				self._arm(channel, duration, self._expire)
+
+	# Switch a channel to the opposite state, cancelling any timed action on it.
+	def toggle_channel(self, channel):
+		with self.timed_lock:
+			self._cancel_timed(channel)
+			self._switch(channel, not getattr(self, channel + "_active"))
+
+	# Flash a channel on for `on` seconds and off for `off` seconds until `duration` seconds have passed,
+	# then leave it off.
+	def pulse(self, channel, on, off, duration):
+		with self.timed_lock:
+			self._cancel_timed(channel)
+			self._pulse(channel, True, on, off, time.monotonic() + duration)
+
+	def cancel_timed(self, channel):
+		with self.timed_lock:
+			self._cancel_timed(channel)
+
+	# Timer callbacks. The wheel may fire a timer just after an agent thread has replaced it, so each one
+	# only acts if it is still the channel's pending action.
+	def _expire(self, channel, token):
+		with self.timed_lock:
+			if self._pending(channel, token):
+				del self.timed[channel]
+				self._switch(channel, False)
+
+	def _pulse_step(self, channel, token, active, on, off, end):
+		with self.timed_lock:
+			if self._pending(channel, token):
+				self._pulse(channel, active, on, off, end)
+
+	# The rest are called with timed_lock held.
+	def _pending(self, channel, token):
+		pending = self.timed.get(channel)
+		return pending is not None and pending[0] is token
+
+	def _cancel_timed(self, channel):
+		pending = self.timed.pop(channel, None)
+		if pending is not None:
+			pending[1].cancel()
+
+	# Schedule callback(channel, token, *args) as the channel's timed action.
+	def _arm(self, channel, delay, callback, *args):
+		token = object()
+		self.timed[channel] = (token, timers.schedule(delay, callback, channel, token, *args))
+
+	def _pulse(self, channel, active, on, off, end):
+		remaining = end - time.monotonic()
+		if remaining <= 0:
+			self.timed.pop(channel, None)
+			self._switch(channel, False)
+			return
+		self._switch(channel, active)
+		self._arm(channel, min(on if active else off, remaining), self._pulse_step, not active, on, off, end)
+
+	def _switch(self, channel, active):
+		attribute = channel + "_active"
+		if getattr(self, attribute) != active:
+			command, on_value, off_value = CHANNELS[channel]
+			self.queueCommand(bytes([command, on_value if active else off_value]))
+			setattr(self, attribute, active)
 
 	def queueCommand(self, command):
-		self.command_queue[command] = int(round(time.time() * 1000))  # Append time of queueing in milliseconds.
+		self.command_queue.put(command)
+
+	def queueDrive(self, command):
+		with self.drive_lock:
+			if not self.drive_held:
+				self.queueCommand(command)
+
+
+# Commands waiting to be sent to a car. Steering and throttle each keep only their latest value, so a car is
+# never sent a stale one, while one-shot effects (lights, horn, siren) are kept in the order they were queued.
+# Agent threads put and the Bluetooth thread takes, so both go through a lock.
+class CommandSlots():
+	LATEST_WINS = (THROTTLE, STEERING)  # Taken first, in this order, as stopping the car matters most.
+
+	def __init__(self):
+		self.slots = {}  # Channel -> latest command.
+		self.effects = deque()
+		self.lock = threading.Lock()
+		self.listener = None  # Called after every put, to wake the Bluetooth sender.
+
+	def put(self, command):
+		with self.lock:
+			if command[0] in self.LATEST_WINS:
+				self.slots[command[0]] = command
+			else:
+				self.effects.append(command)
+		if self.listener is not None:
+			self.listener()
+
+	# Remove and return up to limit pending commands, or all of them if limit is None.
+	def take(self, limit=None):
+		taken = []
+		with self.lock:
+			for channel in self.LATEST_WINS:
+				if channel in self.slots and (limit is None or len(taken) < limit):
+					taken.append(self.slots.pop(channel))
+			while self.effects and (limit is None or len(taken) < limit):
+				taken.append(self.effects.popleft())
+		return taken
+
+	def __len__(self):
+		with self.lock:
+			return len(self.slots) + len(self.effects)
 
 
 class Car(Vehicle):
@@ -1,38 +1,97 @@
 from tracker.core import *
+import threading
 from tracker.camera import Camera
 from tracker.blob_detector import BlobDetector
 from tracker.cone_detector import ConeDetector
 from tracker.calibrator import Calibrator
+from tracker.light_identifier import LightIdentifier
 from tracker.mosse_tracker import MOSSETracker
-from multiprocessing import Process, Manager
+from tracker.recalibrator import Recalibrator
+from tracker.state_table import StateTable, make_rows
+from tracker.transform import Transform, to_pixels
+from constants import *
+from multiprocessing import Process, Event
+from multiprocessing.sharedctypes import RawArray, RawValue
 
 msgHeader = "[VISION]: "
 
+FRAME_PERIOD = 1 / 30  # The supervisor checks the tracker once per camera frame.
+STALL_TIMEOUT = 0.2  # Seconds without a new frame before the tracker is considered stalled.
+STARTUP_GRACE = 3.0  # Extra seconds a new tracker gets for its first frame: fork, MOSSE and feature setup.
+RESTART_BACKOFF = 1.0  # Minimum seconds between tracker restarts.
+MAX_PREDICTION = 0.5  # Seconds positions are extrapolated forward when seeding a restarted tracker.
+
 
 class Vision():
-	def __init__(self):
-		self.cam = Camera()
+	def __init__(self, mode=VISION_MODE):
+		# In thread mode capture and tracking run on threads in this process. OpenCV releases the GIL,
+		# and frames are shared by reference instead of being pickled between processes.
+		self.threaded = mode == "thread"
+		self.cam = Camera(threaded=self.threaded)
 
-		self.homo_matrix = None
+		self.transform = Transform()
+		# Bumped by the tracker before and after it writes a new homography, so it is odd mid-write. No lock,
+		# as the tracker can be killed at any point.
+		self.calibration_version = RawValue('q', 0)
+		self.shared_homography = RawArray('d', 9)
+		self.applied_version = 0
+		self.drift = RawValue('d', 0.0)
 
-		manager = Manager()
-		self.shared_dict = manager.dict()
+		# Tracked entities are shared with the tracking process through shared memory.
+		# Row i of the table always belongs to entity_ids[i].
+		self.state = StateTable(threaded=self.threaded)
+		self.entities = []
+		self.entity_ids = []
+		self.kill_event = None
 		self.worker = None
+		self.frame_seq_start = 0
+
+		# The supervisor restarts the tracking process if it dies or stalls.
+		self.supervisor = None
+		self.supervisor_stopped = False
+		self.tracking_healthy = True
+		self.restarts = 0
 		
 	def getCones(self):
 		cd = ConeDetector()
 		image = self.cam.get_frame()
 		conesKey = cd.findCones(image)
 
-		cones = []
+		if not conesKey:
+			return []
+
+		# Cones are returned in world coordinates so they line up with the display.
+		pixels = [keypoint.pt for keypoint in conesKey]
+		return to_pixels(self.transform.camera_to_world(pixels))
+
+	def identify(self, agents, by_lights=False):
+		entities_found = None
+		if by_lights:
+			entities_found = self._identify_by_lights(agents)
+			if entities_found is None:
+				print(msgHeader + "Falling back to identifying cars left to right.")
+		if entities_found is None:
+			entities_found = self._identify_by_order(agents)
+		if entities_found is None:
+			return False
 
-		for keypoint in conesKey:
-			pos = (int(keypoint.pt[0]), int(keypoint.pt[1]))
-			cones.append(pos)
+		entity_str = ""
+		for i in range(len(entities_found)):
+			if i < len(entities_found) - 2:
+				entity_str += entities_found[i].ID + ", "
+			elif i == len(entities_found) - 2:
+				entity_str += entities_found[i].ID + " and "
+			else:
+				entity_str += entities_found[i].ID
+		print(msgHeader + "Identified entities " + entity_str + ".")
 
-		return cones
+		self.entities = entities_found
+		self.entity_ids = [entity.ID for entity in entities_found]
+		self.state.write(self._entity_rows(entities_found, 0, time.time()))
+		return True
 
-	def identify(self, agents):
+	# Assign IDs left to right on the horizontal axis. Needs 20 consistent frames.
+	def _identify_by_order(self, agents):
 		entities_in_scene = []
 		for agent in agents:
 			entities_in_scene.append(agent.ID)
@@ -68,61 +127,239 @@ class Vision():
 
 			if time.time() - start > 20: # Timeout after 20 seconds.
 				print(msgHeader + "Identification stage timed out.")
-				return False
+				return None
 
-		entity_str = ""
-		for i in range(len(entities_found)):
-			if i < len(entities_found) - 2:
-				entity_str += entities_found[i].ID + ", "
-			elif i == len(entities_found) - 2:
-				entity_str += entities_found[i].ID + " and "
-			else:
-				entity_str += entities_found[i].ID
-		print(msgHeader + "Identified entities " + entity_str + ".")
+		return entities_found
 
-		self.shared_dict["Entities"] = entities_found
-		return True
+	# Flash each car's lights in a distinct code and match the blobs that light up. All cars are
+	# identified in parallel, in any order. Needs the cars to be connected.
+	def _identify_by_lights(self, agents):
+		bd = BlobDetector()
+
+		start = time.time()
+		positions = []
+		while len(positions) != len(agents):
+			if time.time() - start > 5: # Timeout after 5 seconds.
+				print(msgHeader + "Could not find the right number of cars to flash.")
+				return None
+			image = self.cam.get_frame()
+			if image is None:
+				return None
+			positions = [(int(keypoint.pt[0]), int(keypoint.pt[1])) for keypoint in bd.findCars(image)]
+
+		matched = LightIdentifier(self.cam).identify(agents, positions)
+		if matched is None:
+			return None
+
+		entities_found = []
+		for agent, position in sorted(zip(matched, positions), key=lambda pair: agents.index(pair[0])):
+			entity = Entity(agent.ID)
+			entity.position = position
+			entities_found.append(entity)
+		return entities_found
 
 	def calibrate(self):
 		frame = self.cam.get_frame()
-		self.homo_matrix, corners = Calibrator().get_transform(frame)
+		homo_matrix, corners = Calibrator().get_transform(frame)
+		if homo_matrix is not None:
+			self.transform.set_matrix(homo_matrix)
 		return corners
 
 	def start_tracking(self):
-		self.worker = Process(target=self.track, args=(self.shared_dict,))
+		self.frame_seq_start = 0
+		self._start_worker()
+		self.tracking_healthy = True
+		self.supervisor_stopped = False
+		self.supervisor = Thread(target=self.supervise)
+		self.supervisor.daemon = True
+		self.supervisor.start()
+
+	def stop_tracking(self):
+		self.supervisor_stopped = True
+		if self.supervisor is not None:
+			self.supervisor.join()
+		self._stop_worker()
+		self._sync_calibration()
+
+	# Every worker gets its own kill event, so a stuck thread that is abandoned on restart
+	# stops publishing as soon as it wakes up.
+	def _start_worker(self):
+		if self.threaded:
+			self.kill_event = threading.Event()
+			self.worker = Thread(target=self.track, args=(self.state, self.kill_event,))
+		else:
+			self.kill_event = Event()
+			self.worker = Process(target=self.track, args=(self.state, self.kill_event,))
 		self.worker.daemon = True
 		self.worker.start()
 
-	def stop_tracking(self):
-		self.shared_dict["KILL"] = True
-		self.worker.terminate()
-		self.worker.join()
+	def _stop_worker(self):
+		self.kill_event.set()
+		self.worker.join(STALL_TIMEOUT)
+		if self.threaded: # Threads can't be terminated, only abandoned.
+			return
+		if self.worker.is_alive():
+			self.worker.terminate()
+			self.worker.join()
+		self._recover_after_exit()
+
+	# A tracker process that died or was killed may have been halfway through writing the state table or the
+	# homography. Round their sequences up so the replacement can write, and drop the torn homography.
+	def _recover_after_exit(self):
+		self.state.recover()
+		version = self.calibration_version.value
+		if version & 1:
+			self.calibration_version.value = version + 1
+			self.applied_version = version + 1
+
+	# Heartbeat the tracking process through the state table generation. If it dies or stops publishing,
+	# restart it from the last known (and predicted) entity states so no re-identification is needed.
+	def supervise(self):
+		last_generation, latest = self.state.read()
+		previous = None
+		last_progress = time.time() + STARTUP_GRACE
+		last_restart = time.time()
+		while not self.supervisor_stopped:
+			time.sleep(FRAME_PERIOD)
+			generation, rows = self.state.read()
+			now = time.time()
+			if generation != last_generation:
+				last_generation = generation
+				last_progress = now
+				previous, latest = latest, rows
+				self.tracking_healthy = True
+				continue
+			if self.worker.is_alive() and now - last_progress < STALL_TIMEOUT:
+				continue
+
+			if self.tracking_healthy:
+				print(msgHeader + "Tracking stalled.")
+			self.tracking_healthy = False
+			if now - last_restart < RESTART_BACKOFF or not len(latest):
+				continue
+			last_restart = now
+			last_progress = now + STARTUP_GRACE
+			self._restart_worker(previous, latest, now)
+
+	def _restart_worker(self, previous, latest, now):
+		print(msgHeader + "Restarting the tracking process.")
+		self._stop_worker()
+		self._sync_calibration()
+
+		# Extrapolate each entity along its last observed velocity.
+		world = np.column_stack((latest["x"], latest["y"]))
+		if previous is not None and len(previous) == len(latest):
+			dt = latest["capture_ts"] - previous["capture_ts"]
+			moving = dt > 0
+			velocity = np.zeros_like(world)
+			velocity[moving] = (world[moving] - np.column_stack((previous["x"], previous["y"]))[moving]) / dt[moving, None]
+			ahead = np.clip(now - latest["capture_ts"], 0, MAX_PREDICTION)
+			world = world + velocity * ahead[:, None]
+
+		entities = []
+		for row, position in zip(latest, to_pixels(self.transform.world_to_camera(world))):
+			entity = Entity(self.entity_ids[row["id"]])
+			entity.position = position
+			heading = float(row["heading"])
+			entity.orientation = None if np.isnan(heading) else heading
+			entities.append(entity)
+		self.entities = entities
+		self.frame_seq_start = int(latest["frame_seq"].max())
+		self.restarts += 1
+		self.state.reset_notifier()
+		self._start_worker()
 
-	def track(self, shared_dict):
-		shared_dict["KILL"] = False
+	def track(self, state, kill_event):
+		entities = list(self.entities)
+		frame = self.cam.get_frame()
+		tracker = MOSSETracker(entities, frame)
+
+		def publish_homography(homo_matrix, drift):
+			self.calibration_version.value += 1
+			self.shared_homography[:] = np.ravel(homo_matrix)
+			self.calibration_version.value += 1
 
-		entities = list(shared_dict["Entities"])
-		tracker = MOSSETracker(entities, self.cam.get_frame())
+		recalibrator = Recalibrator(self.transform, frame, [entity.position for entity in entities],
+									on_swap=publish_homography).start()
+
+		frame_seq = self.frame_seq_start
 
 		# Main tracking loop.
 		print(msgHeader + "Initialised the MOSSE Tracker.")
 		while True:
-			if shared_dict["KILL"]:
+			if kill_event.is_set():
 				break
 			image = self.cam.get_frame()
 			if image is None:
 				break
+			capture_ts = time.time()
+			frame_seq += 1
 			entities = tracker.process(image)
-			shared_dict["Entities"] = entities
+			if kill_event.is_set():
+				break
+			state.write(self._entity_rows(entities, frame_seq, capture_ts, tracker.lost))
+
+			recalibrator.process(image)
+			self.drift.value = recalibrator.drift
+		recalibrator.stop()
 		return
 
+	# Build state table rows for a list of entities. Positions are stored in world coordinates,
+	# transformed in a single call.
+	def _entity_rows(self, entities, frame_seq, capture_ts, lost=()):
+		rows = make_rows(len(entities))
+		rows["id"] = np.arange(len(entities))
+		world = self.transform.camera_to_world([entity.position for entity in entities])
+		rows["x"] = world[:, 0]
+		rows["y"] = world[:, 1]
+		rows["heading"] = [np.nan if entity.orientation is None else entity.orientation for entity in entities]
+		rows["confidence"] = [0.0 if entity in lost else 1.0 for entity in entities]
+		rows["frame_seq"] = frame_seq
+		rows["capture_ts"] = capture_ts
+		return rows
+
+	# Pick up a homography swapped in by the tracking process. An abandoned tracker thread may still be
+	# writing one, in which case it is picked up next time.
+	def _sync_calibration(self):
+		version = self.calibration_version.value
+		if version == self.applied_version or version & 1:
+			return
+		homo_matrix = np.array(self.shared_homography)
+		if self.calibration_version.value == version:
+			self.transform.set_matrix(homo_matrix)
+			self.applied_version = version
+
+	def get_drift(self):
+		return self.drift.value
+
+	# Generation of the tracking data. Increases by one every time the tracker publishes a frame.
+	def generation(self):
+		return self.state.generation()
+
+	# Block until tracking data newer than since is available. Returns the new generation, or None on timeout.
+	def wait_for_update(self, since, timeout=None):
+		return self.state.wait_for_update(since, timeout)
+
+	# Yield (generation, car_locations) for each new tracking frame. Stops if nothing arrives within timeout.
+	def tracking_updates(self, since=0, timeout=None):
+		while True:
+			if self.wait_for_update(since, timeout) is None:
+				return
+			since, car_locations = self.read_car_locations()
+			yield since, car_locations
+
 	def get_car_locations(self):
+		return self.read_car_locations()[1]
+
+	# Car locations along with the generation they were read from.
+	def read_car_locations(self):
+		generation, rows = self.state.read()
+
 		car_locations = []
-		for entity in self.shared_dict["Entities"]:
-			point = np.matrix([entity.position[0], entity.position[1], 1]).T
-			transformed = np.dot(self.homo_matrix, point)
-			position = (int(transformed[0]), int(transformed[1]))
-			car_locations.append({"ID": entity.ID,
+		for row, position in zip(rows, to_pixels(zip(rows["x"], rows["y"]))):
+			heading = float(row["heading"])
+			car_locations.append({"ID": self.entity_ids[row["id"]],
 								  "position": position,
-								  "orientation": entity.orientation})
-		return car_locations
\ No newline at end of file
+								  "orientation": None if np.isnan(heading) else heading,
+								  "timestamp": float(row["capture_ts"])})
+		return generation, car_locations
@@ -1,32 +1,236 @@
+import math
+import threading
+import time
+import numpy as np
 from constants import *
+from history import PoseHistory, T
+from route import Route
+from spatial import SpatialGrid
+from geometry import bearing, angle_between
 
 
 msgHeader = "[WORLD]: "
 
+# Snapshot pinned by the calling thread (see pin_snapshot), falling back to the latest published one.
+_pinned = threading.local()
+_latest = None
+
+
+# Pin a snapshot for the calling thread so that every vehicle pose it reads comes from the same frame.
+def pin_snapshot(snapshot):
+	_pinned.snapshot = snapshot
+
+
+def current_snapshot():
+	snapshot = getattr(_pinned, 'snapshot', None)
+	if snapshot is None:
+		return _latest
+	return snapshot
+
+
+class WorldSnapshot():
+	def __init__(self, frame, ids, index, poses, grid, static, tracking_healthy):
+		self.frame = frame  # Increases by one with every published snapshot.
+		self.ids = ids  # Vehicle IDs, in pose row order.
+		self.index = index  # ID -> pose row.
+		self.poses = poses  # Read-only N x 3 array of (x, y, heading). NaN where unknown.
+		self.grid = grid  # Spatial index over the located vehicles.
+		self.static = static  # World data that doesn't change during a scenario.
+		self.tracking_healthy = tracking_healthy
+
+	# Lookups by key keep the snapshot usable wherever the old world data dict was.
+	def __getitem__(self, key):
+		if key == 'tracking_healthy':
+			return self.tracking_healthy
+		if key == 'frame':
+			return self.frame
+		return self.static[key]
+
+	def __contains__(self, key):
+		return key in ('tracking_healthy', 'frame') or key in self.static
+
+	def get(self, key, default=None):
+		if key in self:
+			return self[key]
+		return default
+
+	def position(self, ID):
+		row = self.index.get(ID)
+		if row is None or np.isnan(self.poses[row, 0]):
+			return None
+		return (int(self.poses[row, 0]), int(self.poses[row, 1]))
+
+	def orientation(self, ID):
+		row = self.index.get(ID)
+		if row is None or np.isnan(self.poses[row, 2]):
+			return None
+		return float(self.poses[row, 2])
+
+	# Signed distance in display pixels from (x, y) to the nearest wall, negative off the drivable area.
+	def clearance(self, x, y):
+		field = self.static['field']
+		if field is None:
+			return None
+		return field.clearance(x, y)
+
+	# Direction (dx, dy) of increasing clearance at (x, y), pointing away from the nearest wall.
+	def clearance_gradient(self, x, y):
+		field = self.static['field']
+		if field is None:
+			return None
+		return field.gradient(x, y)
+
+	# Pose history of a vehicle, for kinematics over a time window. Live, not frozen with the snapshot.
+	def history(self, vehicle):
+		return self.static['histories'].get(vehicle.owner.ID)
+
+	# Tracker capture time of each vehicle's latest observation, in pose row order. NaN if never seen.
+	# Read from the live histories, so call it from the thread that updates the world.
+	def capture_times(self):
+		histories = self.static['histories']
+		times = np.full(len(self.ids), np.nan)
+		for row, ID in enumerate(self.ids):
+			latest = histories[ID].latest()
+			if latest is not None:
+				times[row] = latest[T]
+		return times
+
+	# Other located vehicles within radius of vehicle, as (vehicle, distance) pairs nearest first.
+	def neighbors_within(self, vehicle, radius):
+		origin = self._origin(vehicle)
+		if origin is None:
+			return []
+		return self._nearby(vehicle, origin, radius)
+
+	# The k located vehicles nearest to vehicle, as (vehicle, distance) pairs nearest first.
+	def k_nearest(self, vehicle, k):
+		origin = self._origin(vehicle)
+		if origin is None or k <= 0:
+			return []
+		# Widen the search until it holds k vehicles. Anything within the radius is exact, so those are the nearest.
+		radius = self.grid.cell_size
+		limit = math.hypot(*self.static['dimensions']) + radius
+		while True:
+			found = self._nearby(vehicle, origin, radius)
+			if len(found) >= k or radius > limit:
+				return found[:k]
+			radius *= 2
+
+	# Other located vehicles within radius and within half_angle degrees either side of vehicle's heading.
+	def in_cone(self, vehicle, radius, half_angle):
+		origin = self._origin(vehicle)
+		heading = self.orientation(vehicle.owner.ID)
+		if origin is None or heading is None:
+			return []
+		found = self._nearby(vehicle, origin, radius)
+		if not found:
+			return []
+		rows = [self.index[other.owner.ID] for other, _ in found]
+		inside = angle_between(bearing(origin, self.poses[rows, 0:2]), heading) < half_angle
+		return [pair for pair, keep in zip(found, inside) if keep]
+
+	def _origin(self, vehicle):
+		row = self.index.get(vehicle.owner.ID)
+		if row is None or np.isnan(self.poses[row, 0]):
+			return None
+		return self.poses[row, 0:2]
+
+	def _nearby(self, vehicle, origin, radius):
+		IDs = [ID for ID in self.grid.candidates(origin[0], origin[1], radius) if ID != vehicle.owner.ID]
+		if not IDs:
+			return []
+		rows = [self.index[ID] for ID in IDs]
+		distances = np.hypot(*(self.poses[rows, 0:2] - origin).T)
+		vehicles = self.static['vehicles']
+		return [(vehicles[rows[i]], float(distances[i])) for i in np.argsort(distances) if distances[i] < radius]
+
 
 class World():
-	def __init__(self, agents, vehicles, map, waypoints):
-		self.world_data = {'agents': agents,
-						   'vehicles': vehicles,
-						   'dimensions': (DISPLAY_WIDTH, DISPLAY_HEIGHT),
-						   'map': map,
-						   'waypoints': waypoints}
+	def __init__(self, agents, vehicles, map, waypoints, route=None, field=None):
+		if route is None:
+			route = Route(waypoints)
+		self.static = {'agents': agents,
+					   'vehicles': vehicles,
+					   'dimensions': (DISPLAY_WIDTH, DISPLAY_HEIGHT),
+					   'map': map,
+					   'waypoints': waypoints,
+					   'route': route,
+					   'field': field,
+					   'histories': {vehicle.owner.ID: PoseHistory() for vehicle in vehicles}}
+		self.vehicle_index = {vehicle.owner.ID: vehicle for vehicle in vehicles}
+		self.ids = tuple(vehicle.owner.ID for vehicle in vehicles)
+		self.index = {ID: row for row, ID in enumerate(self.ids)}
+		self.changed = set()  # IDs of vehicles whose pose changed on the last update.
+		self.snapshot = None
+		self._publish(np.full((len(self.ids), 3), np.nan), SpatialGrid(), True)
 		print(msgHeader + "Initialisation complete.")
 
-	# Update the world state.
+	# Swap in a new immutable snapshot. A single reference assignment, so readers never see a partial update.
+	def _publish(self, poses, grid, tracking_healthy):
+		global _latest
+		poses.flags.writeable = False
+		frame = 0 if self.snapshot is None else self.snapshot.frame + 1
+		self.snapshot = WorldSnapshot(frame, self.ids, self.index, poses, grid, self.static, tracking_healthy)
+		_latest = self.snapshot
+
+	# Update the world state in one pass over the observations. Returns the IDs of vehicles that changed.
 	def update(self, car_locations):
-		for known_vehicle in self.world_data['vehicles']:
-			updated = False
-			for observed_car in car_locations:
-				if observed_car['ID'] == known_vehicle.owner.ID:
-					known_vehicle.position = observed_car['position']
-					known_vehicle.orientation = observed_car['orientation']
-					updated = True
-					break
-			if not updated:
-				known_vehicle.position = None
-				known_vehicle.orientation = None
-		#print(self.world_data)
+		histories = self.static['histories']
+		poses = np.full((len(self.ids), 3), np.nan)
+		for observed_car in car_locations:
+			row = self.index.get(observed_car['ID'])
+			if row is None or observed_car['position'] is None:
+				continue
+			poses[row, 0:2] = observed_car['position']
+			if observed_car['orientation'] is not None:
+				poses[row, 2] = observed_car['orientation']
+			histories[observed_car['ID']].append(observed_car.get('timestamp', time.time()),
+												 observed_car['position'][0], observed_car['position'][1],
+												 observed_car['orientation'])
+
+		previous = self.snapshot.poses
+		same = (poses == previous) | (np.isnan(poses) & np.isnan(previous))
+		changed_rows = np.flatnonzero(~same.all(axis=1))
+		self.changed = {self.ids[row] for row in changed_rows}
+		if self.changed:
+			# Only the vehicles that moved are re-filed in the spatial index.
+			moves = {}
+			for row in changed_rows:
+				moves[self.ids[row]] = None if np.isnan(poses[row, 0]) else poses[row, 0:2]
+			grid = self.snapshot.grid.moved(moves)
+			self._publish(poses, grid, self.snapshot.tracking_healthy)
+		return self.changed
+
+	# IDs of vehicles that changed on the last update.
+	def get_changes(self):
+		return self.changed
+
+	# Record whether the tracker is live. Returns True if the flag changed.
+	def set_tracking_healthy(self, healthy):
+		if self.snapshot.tracking_healthy == healthy:
+			return False
+		self._publish(np.array(self.snapshot.poses), self.snapshot.grid, healthy)
+		return True
+
+	def history(self, vehicle):
+		return self.snapshot.history(vehicle)
+
+	def clearance(self, x, y):
+		return self.snapshot.clearance(x, y)
+
+	def clearance_gradient(self, x, y):
+		return self.snapshot.clearance_gradient(x, y)
+
+	# Spatial queries against the latest snapshot. See WorldSnapshot.
+	def neighbors_within(self, vehicle, radius):
+		return self.snapshot.neighbors_within(vehicle, radius)
+
+	def k_nearest(self, vehicle, k):
+		return self.snapshot.k_nearest(vehicle, k)
+
+	def in_cone(self, vehicle, radius, half_angle):
+		return self.snapshot.in_cone(vehicle, radius, half_angle)
 
+	# The latest snapshot. Immutable, so it can be handed to any thread without copying.
 	def get_world_data(self):
-		return dict(self.world_data)
+		return self.snapshot
@@ -1,3 +1,4 @@
+import os
 import select
 import threading
 import time
@@ -5,11 +6,10 @@ import csv
 from bluetooth import *
 
 from constants import *
+from zenwheels.protocol import COMMAND_SIZE, MAX_PACKET_SIZE
 
 msgHeader = "[CAR COMMS]: "
 
-BT_LOOP_SLEEP = 25
-
 
 def read_cars_csv():
 	file = csv.DictReader(open(os.path.join(ZENWHEELS_DIR, 'cars.csv')))
@@ -24,10 +24,18 @@ class CarCommunicator():
 		self.cars_info = read_cars_csv()
 		self.active_vehicles = None
 		self.car_sockets = {}
+		self.unsent = {}  # Car ID -> tail of a packet the socket didn't accept in full.
+		# Self-pipe written whenever a command is queued, so the sender can sleep in select until there's work.
+		self.wake_read, self.wake_write = os.pipe()
+		os.set_blocking(self.wake_read, False)
+		os.set_blocking(self.wake_write, False)
+		self.sender = None
 
 	def connectToCars(self, vehicles):
 		print(msgHeader + "Connecting to the ZenWheels cars...")
 		self.active_vehicles = vehicles
+		for vehicle in vehicles:
+			vehicle.command_queue.listener = self.wake
 
 		for vehicle in self.active_vehicles:
 			car_id = vehicle.owner.ID
@@ -65,30 +73,70 @@ class CarCommunicator():
 
 
 	def startCarComms(self):
-		t_process = threading.Thread(target=self.bt_send)
-		t_process.daemon = True
-		t_process.start()
+		if self.sender is not None: # One sender serves every scenario; it picks up the new vehicles.
+			self.wake()
+			return
+		self.sender = threading.Thread(target=self.bt_send)
+		self.sender.daemon = True
+		self.sender.start()
+
+	# Called by a vehicle's command queue, from whichever thread queued the command.
+	def wake(self):
+		try:
+			os.write(self.wake_write, b"\0")
+		except BlockingIOError: # The pipe is full, so the sender is already due to wake.
+			pass
 
 	def bt_send(self):
 		while True:
+			# Only wait on sockets with something to send, so an idle link sleeps in select until woken.
+			pending = {}
 			for vehicle in self.active_vehicles:
-				socket = self.car_sockets[vehicle.owner.ID]
+				socket = self.car_sockets.get(vehicle.owner.ID)
 				if socket is None: continue # Connection to this car was lost.
+				if vehicle.command_queue or vehicle.owner.ID in self.unsent:
+					pending[socket] = vehicle
+			try:
+				can_read, can_write, has_error = select.select([self.wake_read], list(pending), [])
+			except (BluetoothError, OSError, ValueError) as e:
+				self.drop_broken(pending, e)
+				continue
+			if self.wake_read in can_read:
+				self.drain_wakeups()
+			for socket in can_write:
+				vehicle = pending[socket]
 				try:
-					can_read, can_write, has_error = select.select([], [socket], [], 0)
-					if socket in can_write:
-						try:
-							if not vehicle.command_queue:
-								continue
-							command = vehicle.command_queue.popitem()
-							socket.send(command[0])
-						except Exception as e:
-							print(msgHeader + str(e))
-							pass
-				except (BluetoothError, OSError, ValueError) as e:
-					print(msgHeader + str(e))
-					socket.close()
-					self.car_sockets[vehicle.owner.ID] = None
-
-			# Ray: Sleep is essential otherwise all system resources are taken and total system delay skyrockets.
-			time.sleep(BT_LOOP_SLEEP / 1000)
+					# Everything pending for this car goes out as one packet.
+					packet = self.unsent.pop(vehicle.owner.ID, b"")
+					packet += b"".join(vehicle.command_queue.take((MAX_PACKET_SIZE - len(packet)) // COMMAND_SIZE))
+					if not packet:
+						continue
+					sent = socket.send(packet)
+					if sent < len(packet):
+						self.unsent[vehicle.owner.ID] = packet[sent:]
+				except (BluetoothError, OSError) as e:
+					self.close(vehicle, socket, e)
+
+	def drain_wakeups(self):
+		try:
+			while os.read(self.wake_read, 4096):
+				pass
+		except BlockingIOError:
+			pass
+
+	# A select over every socket fails as a whole, so check them one by one to find the broken ones.
+	def drop_broken(self, pending, error):
+		for socket, vehicle in pending.items():
+			try:
+				select.select([], [socket], [], 0)
+			except (BluetoothError, OSError, ValueError):
+				self.close(vehicle, socket, error)
+
+	def close(self, vehicle, socket, error):
+		print(msgHeader + str(error))
+		try:
+			socket.close()
+		except (BluetoothError, OSError):
+			pass
+		self.car_sockets[vehicle.owner.ID] = None
+		self.unsent.pop(vehicle.owner.ID, None)
@@ -8,6 +8,10 @@ Notes:
  * Maximum packet size is 128 bytes
 """
 
+# Message and packet sizes in bytes
+COMMAND_SIZE = 2
+MAX_PACKET_SIZE = 128
+
 # Bluetooth service UUID
 CAR_UUID = '00001101-0000-1000-8000-00805F9B34FB'
 